@@ -0,0 +1,62 @@
+"""
+Times the PCA bootstrap on synthetic daily returns with a growing number of worker processes
+and compares it with serial refits through the PCA class.
+Run from the repository root: python -m benchmarks.bootstrap_benchmark --symbols 160 --years 4 --workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+import numpy as np
+from pca_dax.data_handler import PCA
+from pca_dax.pca_engines import BootstrapPCA
+from benchmarks.rolling_pca_benchmark import make_returns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--symbols', type=int, default=160)
+    parser.add_argument('--years', type=int, default=4)
+    parser.add_argument('--n-boot', type=int, default=500)
+    parser.add_argument('--block-size', type=int, default=1)
+    parser.add_argument('--n-comp', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--serial-sample', type=int, default=20)
+    args = parser.parse_args()
+
+    returns = make_returns(args.symbols, args.years)
+    rng = np.random.default_rng(0)
+
+    # the naive way: materialize every resampled frame and refit it, extrapolated from a sample
+    start = time.perf_counter()
+
+    for _ in range(args.serial_sample):
+        PCA(data=returns.iloc[rng.integers(0, len(returns), size=len(returns))].reset_index(drop=True)).fit(
+            n_comp=args.n_comp
+        )
+
+    serial_time = (time.perf_counter() - start) * args.n_boot / args.serial_sample
+    print(f'{args.n_boot} replicas, {args.symbols} stocks, {len(returns)} days, block size {args.block_size}')
+    print(f'serial PCA refits : {serial_time:8.2f}s  (extrapolated from {args.serial_sample} replicas)')
+
+    base_time = None
+
+    for workers in sorted(set(args.workers)):
+        start = time.perf_counter()
+        result = BootstrapPCA(
+            returns
+            , n_boot=args.n_boot
+            , block_size=args.block_size
+            , n_comp=args.n_comp
+            , max_workers=workers
+            , random_state=0
+        ).fit()
+        elapsed = time.perf_counter() - start
+        base_time = base_time or elapsed
+
+        print(f'{workers:>3} workers       : {elapsed:8.2f}s  speed-up {base_time / elapsed:5.2f}x'
+              f'  PC2 explained variance CI [{result.explained_variance_ci[0, 1]:.4f}'
+              f', {result.explained_variance_ci[1, 1]:.4f}]')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares the portfolio risk of the PCA factor model with the product of the dense covariance matrix
+for a batch of random portfolios, once for the volatilities only and once with the marginal contributions.
+Run from the repository root: python -m benchmarks.factor_risk_benchmark --sizes 160 600 --portfolios 5000
+"""
+import argparse
+import time
+import numpy as np
+from pca_dax.data_handler import PCA
+from pca_dax.factor_risk import FactorRiskModel
+from benchmarks.rolling_pca_benchmark import make_returns
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def dense_volatility(weights: np.ndarray, covariance: np.ndarray) -> np.ndarray:
+    return np.sqrt(np.einsum('pi,pi->p', weights @ covariance, weights))
+
+
+def dense_marginal(weights: np.ndarray, covariance: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    cov_w = weights @ covariance
+    volatility = np.sqrt(np.einsum('pi,pi->p', cov_w, weights))
+
+    return volatility, cov_w / volatility[:, None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[160, 600])
+    parser.add_argument('--portfolios', type=int, default=5000)
+    parser.add_argument('--n-comp', type=int, default=10)
+    parser.add_argument('--years', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.portfolios} portfolios, {args.n_comp} factors')
+    print(f'{"N":>6}{"":>12}{"factor model":>16}{"dense":>12}{"speed-up":>10}{"max |dvol|":>12}')
+
+    for n_stocks in args.sizes:
+        returns = make_returns(n_stocks, args.years)
+        model = FactorRiskModel.from_pca(PCA(data=returns).fit(n_comp=args.n_comp), returns)
+        covariance = model.covariance()
+
+        weights = np.random.default_rng(0).dirichlet(np.ones(n_stocks), size=args.portfolios)
+
+        error = np.max(np.abs(model.portfolio_risk(weights).volatility - dense_volatility(weights, covariance)))
+
+        for label, factor_func, dense_func in [
+            ('volatility', lambda: model.portfolio_risk(weights, marginal=False)
+             , lambda: dense_volatility(weights, covariance))
+            , ('+ marginal', lambda: model.portfolio_risk(weights), lambda: dense_marginal(weights, covariance))
+        ]:
+            factor_time = best_time(factor_func, args.repeat)
+            dense_time = best_time(dense_func, args.repeat)
+
+            print(f'{n_stocks:>6}{label:>12}{factor_time * 1000:>14.2f}ms{dense_time * 1000:>10.2f}ms'
+                  f'{dense_time / factor_time:>9.1f}x{error:>12.2e}')
+
+
+if __name__ == '__main__':
+    main()
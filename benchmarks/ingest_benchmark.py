@@ -0,0 +1,85 @@
+"""
+Compares the per-row and the bulk ingestion paths of pca_dax.db on synthetic stocks data.
+Run from the repository root: python -m benchmarks.ingest_benchmark --symbols 160 --years 12
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pca_dax import db
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(db.__file__), 'schema.sql')
+
+
+def make_stocks_df(n_symbols: int, n_years: int, seed: int = 0) -> pd.DataFrame:
+    """Creates a long dataframe in the format returned by DataHandler.fetch_stocks_from_api"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2010-01-01', periods=252 * n_years)
+    symbols = [f'SYM{i:04d}.DE' for i in range(n_symbols)]
+
+    index = pd.MultiIndex.from_product([dates, symbols], names=['Date', 'Symbol'])
+    prices = 100 * np.exp(rng.normal(0, 0.01, size=len(index)).cumsum())
+
+    df = pd.DataFrame({
+        'Open': prices
+        , 'High': prices * 1.01
+        , 'Low': prices * 0.99
+        , 'Close': prices
+        , 'Adj Close': prices
+        , 'Volume': rng.integers(1_000, 1_000_000, size=len(index)).astype(float)
+    }, index=index)
+
+    return df.reset_index()
+
+
+def new_database(directory: str, name: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(directory, name))
+
+    with open(SCHEMA_PATH) as f:
+        conn.executescript(f.read())
+
+    return conn
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--symbols', type=int, default=160)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=db.BULK_BATCH_SIZE)
+    args = parser.parse_args()
+
+    stocks_df = make_stocks_df(args.symbols, args.years)
+    print(f'{len(stocks_df)} rows, {args.symbols} symbols, {args.years} years')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = new_database(tmp, 'per_row.sqlite')
+        elapsed, counts = timed(db._ingest_stocks, stocks_df, conn=conn, bulk=False)
+        print(f'per-row      : {elapsed:8.2f}s  {db._format_counts(counts)}')
+        conn.close()
+
+        conn = new_database(tmp, 'bulk.sqlite')
+        elapsed, counts = timed(db._ingest_stocks, stocks_df, conn=conn, batch_size=args.batch_size)
+        print(f'bulk         : {elapsed:8.2f}s  {db._format_counts(counts)}')
+
+        # a second pass over the same rows measures the cost of the overlap handling
+        elapsed, counts = timed(db._ingest_stocks, stocks_df, conn=conn, batch_size=args.batch_size)
+        print(f'bulk, rerun  : {elapsed:8.2f}s  {db._format_counts(counts)}')
+
+        elapsed, counts = timed(db._ingest_stocks, stocks_df, conn=conn, batch_size=args.batch_size, upsert=True)
+        print(f'bulk, upsert : {elapsed:8.2f}s  {db._format_counts(counts)}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Times the PCA eigensolvers on synthetic correlation matrices of a growing universe
+and reports where the truncated and randomized solvers overtake the full decomposition.
+Run from the repository root: python -m benchmarks.pca_solver_benchmark --sizes 100 160 300 600 1000 2000
+"""
+import argparse
+import time
+import numpy as np
+from pca_dax.data_handler import decompose, MATRIX_SOLVERS
+
+
+def make_correlation(n_stocks: int, n_days: int = 3000, n_factors: int = 5, seed: int = 0) -> np.ndarray:
+    """Correlation matrix of returns driven by a few common factors plus idiosyncratic noise"""
+    rng = np.random.default_rng(seed)
+    factors = rng.standard_normal((n_days, n_factors))
+    betas = rng.normal(0.5, 0.3, size=(n_factors, n_stocks))
+    returns = factors @ betas + rng.standard_normal((n_days, n_stocks))
+
+    return np.corrcoef(returns, rowvar=False)
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 160, 300, 600, 1000, 2000])
+    parser.add_argument('--n-comp', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"N":>6}' + ''.join(f'{solver:>14}' for solver in MATRIX_SOLVERS) + f'{"max |dλ|":>12}')
+
+    for n_stocks in args.sizes:
+        mtrx = make_correlation(n_stocks)
+        timings = {}
+        eigenvalues = {}
+
+        for solver in MATRIX_SOLVERS:
+            timings[solver] = best_time(lambda: decompose(mtrx, args.n_comp, solver=solver), args.repeat)
+            eigenvalues[solver] = decompose(mtrx, args.n_comp, solver=solver)[0][:args.n_comp]
+
+        error = max(np.max(np.abs(eigenvalues[solver] - eigenvalues['full'])) for solver in MATRIX_SOLVERS)
+        faster = [solver for solver in MATRIX_SOLVERS if timings[solver] < timings['full']]
+
+        print(f'{n_stocks:>6}' + ''.join(f'{timings[solver] * 1000:>12.2f}ms' for solver in MATRIX_SOLVERS)
+              + f'{error:>12.2e}' + (f'   faster: {", ".join(faster)}' if faster else ''))
+
+
+if __name__ == '__main__':
+    main()
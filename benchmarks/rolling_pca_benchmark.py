@@ -0,0 +1,76 @@
+"""
+Compares the rolling PCA engine with refitting the covariance or correlation matrix of every window from scratch
+on synthetic daily returns. The refit is timed on a sample of windows and extrapolated to the whole roll.
+Run from the repository root: python -m benchmarks.rolling_pca_benchmark --symbols 160 --years 12
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from pca_dax.data_handler import decompose
+from pca_dax.pca_engines import RollingPCA
+
+
+def make_returns(n_stocks: int, n_years: int, n_factors: int = 5, seed: int = 0) -> pd.DataFrame:
+    """Daily returns driven by a few common factors whose betas drift over time"""
+    rng = np.random.default_rng(seed)
+    n_days = 252 * n_years
+    factors = rng.standard_normal((n_days, n_factors)) * 0.01
+    betas = rng.normal(0.5, 0.3, size=(n_factors, n_stocks)) + rng.normal(0, 0.002, size=(n_days, n_factors, n_stocks)).cumsum(axis=0)
+    returns = np.einsum('tf,tfn->tn', factors, betas) + rng.standard_normal((n_days, n_stocks)) * 0.01
+
+    return pd.DataFrame(
+        returns
+        , index=pd.bdate_range('2010-01-01', periods=n_days)
+        , columns=[f'SYM{i:04d}.DE' for i in range(n_stocks)]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--symbols', type=int, default=160)
+    parser.add_argument('--years', type=int, default=12)
+    parser.add_argument('--window', type=int, default=252)
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--n-comp', type=int, default=10)
+    parser.add_argument('--cov', action='store_true', help='use the covariance matrix instead of the correlation one')
+    parser.add_argument('--refit-sample', type=int, default=50)
+    args = parser.parse_args()
+
+    returns = make_returns(args.symbols, args.years)
+
+    start = time.perf_counter()
+    result = RollingPCA(
+        returns
+        , window=args.window
+        , step=args.step
+        , cov_base=args.cov
+        , n_comp=args.n_comp
+    ).fit()
+    rolling_time = time.perf_counter() - start
+
+    n_windows = len(result.dates)
+    sample = np.linspace(0, n_windows - 1, min(args.refit_sample, n_windows)).astype(int)
+    refit_time = 0
+    errors = []
+
+    for i in sample:
+        end = args.window + i * args.step
+        start = time.perf_counter()
+        window_returns = returns.iloc[end - args.window:end]
+        mtrx = window_returns.cov() if args.cov else window_returns.corr()
+        eigvls, _ = decompose(mtrx, n_comp=args.n_comp)
+        refit_time += time.perf_counter() - start
+
+        errors.append(np.max(np.abs(eigvls[:args.n_comp] - result.eigenvalues[i]) / eigvls[0]))
+
+    refit_time *= n_windows / len(sample)
+
+    print(f'{n_windows} windows of {args.window} days, {args.symbols} stocks, step {args.step}')
+    print(f'rolling : {rolling_time:8.2f}s  mean iterations {result.iterations[1:].mean():.1f}')
+    print(f'refit   : {refit_time:8.2f}s  (extrapolated from {len(sample)} windows, {refit_time / rolling_time:.1f}x)')
+    print(f'max relative eigenvalue error: {max(errors):.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Compares the range-query latency of the first stocks storage layout with the current one.
+A synthetic database is created with the old layout, copied and migrated with pca_dax.db.migrate_db.
+Run from the repository root: python -m benchmarks.storage_benchmark --symbols 160 --years 12
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from pca_dax import db
+
+
+V1_SCHEMA = """
+    CREATE TABLE companies (
+        symbol VARCHAR(15) PRIMARY KEY
+    );
+
+    CREATE TABLE stocks (
+        date DATETIME NOT NULL,
+        symbol VARCHAR(15),
+        open DECIMAL(18, 4),
+        high DECIMAL(18, 4),
+        low DECIMAL(18, 4),
+        close DECIMAL(18, 4),
+        adj_close DECIMAL(18, 4),
+        volume INTEGER DEFAULT 0,
+        CONSTRAINT con_symbol_date PRIMARY KEY(symbol, date),
+        FOREIGN KEY (symbol) REFERENCES companies(symbol)
+    );
+"""
+
+
+def business_days(n_years: int) -> list[date]:
+    days = []
+    day = date(2010, 1, 1)
+
+    while len(days) < 252 * n_years:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+
+    return days
+
+
+def create_v1_database(path: str, symbols: list[str], days: list[date]) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(V1_SCHEMA)
+
+    for symbol in symbols:
+        price = 100.0
+        rows = []
+
+        for day in days:
+            price *= 1 + random.gauss(0, 0.01)
+            rows.append((day.isoformat(), symbol, price, price, price, price, price, 1000))
+
+        conn.executemany("""INSERT INTO stocks VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+
+    conn.commit()
+    conn.close()
+
+
+def random_queries(symbols: list[str], days: list[date], n_queries: int, n_symbols: int) -> list[tuple]:
+    queries = []
+
+    for _ in range(n_queries):
+        start, end = sorted(random.sample(range(len(days)), 2))
+        queries.append((days[start], days[end], random.sample(symbols, min(n_symbols, len(symbols)))))
+
+    return queries
+
+
+def run_queries(path: str, queries: list[tuple], day_numbers: bool) -> float:
+    conn = sqlite3.connect(path)
+    elapsed = 0
+
+    for start, end, symbols in queries:
+        if day_numbers:
+            bounds = (db.to_day_number(start), db.to_day_number(end))
+        else:
+            bounds = (start.isoformat(), end.isoformat())
+
+        placeholders = ', '.join('?' * len(symbols))
+        query_start = time.perf_counter()
+        conn.execute(
+            f"""
+                SELECT date, symbol, adj_close
+                FROM stocks
+                WHERE date BETWEEN ? AND ?
+                AND symbol IN ({placeholders})
+            """
+            , (*bounds, *symbols)
+        ).fetchall()
+        elapsed += time.perf_counter() - query_start
+
+    conn.close()
+
+    return elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--symbols', type=int, default=160)
+    parser.add_argument('--years', type=int, default=12)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--query-symbols', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    symbols = [f'SYM{i:04d}.DE' for i in range(args.symbols)]
+    days = business_days(args.years)
+    queries = random_queries(symbols, days, args.queries, args.query_symbols)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        v1_path = os.path.join(tmp, 'v1.sqlite')
+        v2_path = os.path.join(tmp, 'v2.sqlite')
+
+        create_v1_database(v1_path, symbols, days)
+        shutil.copy(v1_path, v2_path)
+
+        conn = sqlite3.connect(v2_path)
+        migration_start = time.perf_counter()
+        rows = db.migrate_db(conn)
+        print(f'migrated {rows} rows in {time.perf_counter() - migration_start:.2f}s')
+        conn.close()
+
+        print(f'file size   v1: {os.path.getsize(v1_path) / 2 ** 20:8.1f} MiB'
+              f'  v2: {os.path.getsize(v2_path) / 2 ** 20:8.1f} MiB')
+
+        v1_latency = run_queries(v1_path, queries, day_numbers=False)
+        v2_latency = run_queries(v2_path, queries, day_numbers=True)
+        print(f'range query v1: {v1_latency * 1000:8.2f} ms  v2: {v2_latency * 1000:8.2f} ms'
+              f'  ({v1_latency / v2_latency:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
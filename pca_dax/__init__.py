@@ -15,6 +15,8 @@ def create_app(test_config=None) -> flask.Flask:
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY')
         , DATABASE=os.path.join(app.instance_path, 'pca_project.sqlite')
+        , SNAPSHOT_DIR=os.path.join(app.instance_path, 'snapshot')
+        , HTTP_CACHE_DIR=os.path.join(app.instance_path, 'http_cache')
     )
 
     if test_config is None:
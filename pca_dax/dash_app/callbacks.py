@@ -1,35 +1,28 @@
 from dash import Input, Output, callback
-from pca_dax import data_handler as dh
+from pca_dax import market_data as md
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 from pca_dax.common import FIRST_DATE, DATE_FORMAT, COLORS
 
 
-def get_date_mask(data, start_date, end_date):
-    if start_date is not None and end_date is not None:
-        date_mask = (data.index > start_date) & (data.index < end_date)
-    elif start_date is not None:
-        date_mask = (data.index > start_date) & (data.index < datetime.today().strftime(DATE_FORMAT))
-    elif end_date is not None:
-        date_mask = (data.index > FIRST_DATE) & (data.index < end_date)
-    else:
-        date_mask = True
+def get_date_bounds(start_date, end_date):
+    """
+    Fills in the open end of a date range picked on one side only: today for a missing end date,
+    the first date for a missing start date
+    :return: the exclusive date bounds, both None if neither date is picked
+    """
+    if start_date is not None and end_date is None:
+        end_date = datetime.today().strftime(DATE_FORMAT)
+    elif start_date is None and end_date is not None:
+        start_date = FIRST_DATE
 
-    return date_mask
+    return start_date, end_date
 
 
 def register_callbacks(dashapp):
-    data_instance = dh.DataHandler(
-        start_date=FIRST_DATE
-    )
-    data = data_instance.fetch_stocks_from_db(
-        wide_format=False
-        , price_type='open, high, low, close, adj_close'
-    )
-    info_data = data_instance.fetch_info_from_db()[['symbol', 'sector']]
-    rts = data_instance.create_daily_change()
-    mrts = data_instance.create_monthly_change()
+    # the data are loaded by the shared store on the first callback that needs them
+    store = md.get_store()
 
     @dashapp.callback(
         Output('stocks-linechart', 'figure')
@@ -38,12 +31,11 @@ def register_callbacks(dashapp):
         , Input('date-picker-range', 'end_date')
     )
     def update_candlestick_graph(selected_stock, start_date, end_date):
-        date_mask = get_date_mask(data, start_date, end_date)
-
-        filtered_data = data[
-                (data.symbol == selected_stock)
-                & date_mask
-            ]
+        filtered_data = store.get_partitions().get(
+            selected_stock
+            , *get_date_bounds(start_date, end_date)
+            , columns=['open', 'high', 'low', 'close']
+        )
 
         fig = go.Figure(go.Candlestick(
             x=filtered_data.index
@@ -83,30 +75,30 @@ def register_callbacks(dashapp):
     @dashapp.callback(
         Output('sectors-linechart', 'figure')
         , Input('sectors-dropdown', 'value')
+        , Input('sectors-measure', 'value')
         , Input('date-picker-range', 'start_date')
         , Input('date-picker-range', 'end_date')
     )
-    def update_sectors_graph(selected_sector, start_date, end_date):
-        mean_by_sector = (
-            data
-            .reset_index()[['date', 'symbol', 'adj_close']]
-            .merge(
-                info_data
-                , left_on='symbol'
-                , right_on='symbol'
-            )[['date', 'adj_close', 'sector']]
-            .groupby(by=['date', 'sector'])
-            .mean()
-            .reset_index('sector')
+    def update_sectors_graph(selected_sector, measure, start_date, end_date):
+        cube = store.get_sector_cube()
+        measures = {
+            'Mean Price': cube.mean_price
+            , 'Equal-Weighted': cube.equal_weighted
+            , 'Cap-Weighted': cube.cap_weighted
+        }
+        data = measures.get(measure, cube.mean_price)
+
+        start_date, end_date = get_date_bounds(start_date, end_date)
+        first = 0 if start_date is None else data.index.searchsorted(start_date, side='right')
+        last = len(data) if end_date is None else data.index.searchsorted(end_date, side='left')
+
+        filtered_data = (
+            data.iloc[first:max(first, last)]
+            .loc[:, data.columns.isin(selected_sector or [])]
+            .melt(value_name='adj_close', ignore_index=False)
+            .dropna()
         )
 
-        date_mask = get_date_mask(mean_by_sector, start_date, end_date)
-
-        filtered_data = mean_by_sector[
-            mean_by_sector['sector'].isin(selected_sector)
-            & date_mask
-        ]
-
         fig = px.line(
             filtered_data
             , x=filtered_data.index
@@ -144,7 +136,7 @@ def register_callbacks(dashapp):
             showline=True
             , showgrid=True
             , zeroline=False
-            , title='Price'
+            , title='Price' if data is cube.mean_price else 'Index'
             , title_font=dict(size=16, color=COLORS['white'])
             , tickfont=dict(size=14, color=COLORS['white'])
         )
@@ -154,18 +146,34 @@ def register_callbacks(dashapp):
     @dashapp.callback(
         Output('mean-vol-scatterplot', 'figure')
         , Input('daily-monthly-type', 'value')
+        , Input('mean-vol-colour', 'value')
     )
-    def update_scatter_graph(daily_value):
+    def update_scatter_graph(daily_value, colour_value):
         daily_mask = (daily_value == 'Daily')
-        mean_var = data_instance.create_mean_var_df(daily_freq=daily_mask)
+        mean_var = store.get_mean_var(daily_freq=daily_mask)
+
+        if colour_value == 'Idiosyncratic Share':
+            fig = px.scatter(
+                x=mean_var['vol']
+                , y=mean_var['mean']
+                , color=mean_var['idio_share']
+                , hover_name=mean_var['symbol']
+                , color_continuous_scale=COLORS['palette']
+                , range_color=(0, 1)
+            )
 
-        fig = px.scatter(
-            x=mean_var['vol']
-            , y=mean_var['mean']
-            , color=mean_var['sector']
-            , hover_name=mean_var['symbol']
-            , color_discrete_sequence=COLORS['palette']
-        )
+            fig.update_layout(coloraxis_colorbar=dict(
+                title=dict(text='Idiosyncratic<br>Share', font=dict(size=12, color=COLORS['white']))
+                , tickfont=dict(size=12, color=COLORS['white'])
+            ))
+        else:
+            fig = px.scatter(
+                x=mean_var['vol']
+                , y=mean_var['mean']
+                , color=mean_var['sector']
+                , hover_name=mean_var['symbol']
+                , color_discrete_sequence=COLORS['palette']
+            )
 
         fig.update_traces(customdata=mean_var['symbol'])
         fig.update_layout(margin={'l': 40, 'b': 40, 't': 40, 'r': 40}
@@ -244,8 +252,8 @@ def register_callbacks(dashapp):
         colour = hoverData['points'][0]['curveNumber']
 
         ts = (
-            data[data['symbol'] == symbol]
-            .reset_index()[['date', 'adj_close']]
+            store.get_partitions().get(symbol, columns=['adj_close'])
+            .reset_index()
             .rename(columns={'adj_close': 'value'})
         )
 
@@ -264,9 +272,9 @@ def register_callbacks(dashapp):
         colour = hoverData['points'][0]['curveNumber']
 
         if daily_value == 'Daily':
-            df = rts[symbol]
+            df = store.get_daily_returns()[symbol]
         else:  # daily_value == 'Monthly'
-            df = mrts[symbol]
+            df = store.get_monthly_returns()[symbol]
 
         ts = (
             df
@@ -1,6 +1,6 @@
 from dash import dcc, html
 import dash_bootstrap_components as dbc
-from pca_dax import data_handler as dh
+from pca_dax import market_data as md
 from datetime import datetime
 from pca_dax.common import (
     FIRST_DATE
@@ -15,9 +15,9 @@ from pca_dax.common import (
 
 
 def get_layout():
-    data = dh.DataHandler()
-    tickers = data.get_tickers()
-    sectors = data.fetch_info_from_db()['sector'].unique().tolist()
+    store = md.get_store()
+    tickers = store.get_tickers()
+    sectors = store.get_sectors()
 
     layout = dbc.Container([
         get_header(pca_active=False)
@@ -98,8 +98,10 @@ def get_layout():
 
                             , get_info_button(
                                 button_id='sectors-tooltip'
-                                , title='This chart shows and compares mean daily returns of selected sectors '
-                                        'over the chosen time period'
+                                , title='This chart shows and compares the mean prices of selected sectors '
+                                        'over the chosen time period, or their equal-weighted and cap-weighted '
+                                        'return indices, which start at 100 and weight the stocks by their '
+                                        'current market cap'
                             )
 
                             , dcc.Dropdown(
@@ -110,6 +112,15 @@ def get_layout():
                                 , multi=True
                             )
 
+                            , dbc.RadioItems(
+                                options=['Mean Price', 'Equal-Weighted', 'Cap-Weighted']
+                                , id='sectors-measure'
+                                , inline=True
+                                , labelClassName='btn btn-outline-primary'
+                                , labelCheckedClassName='btn-primary'
+                                , value='Mean Price'
+                            )
+
                             , dcc.Graph(
                                 id='sectors-linechart'
                             )
@@ -139,6 +150,8 @@ def get_layout():
                                         'over all time period. You can choose either daily or monthly returns '
                                         'as a basis for the graph. When you hover over one of the stocks, '
                                         'the graphs on the right will be updated accordingly. '
+                                        'The stocks can be coloured either by their sector or by the share '
+                                        'of their variance not explained by the first five principal components. '
                             )
 
                             , dbc.RadioItems(
@@ -149,6 +162,15 @@ def get_layout():
                                 , labelCheckedClassName='btn-primary'
                                 , value='Monthly'
                             )
+
+                            , dbc.RadioItems(
+                                options=['Sector', 'Idiosyncratic Share']
+                                , id='mean-vol-colour'
+                                , inline=True
+                                , labelClassName='btn btn-outline-primary'
+                                , labelCheckedClassName='btn-primary'
+                                , value='Sector'
+                            )
                         ])
                     ])
                 ])
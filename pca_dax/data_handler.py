@@ -1,22 +1,25 @@
-import urllib.request
 import zipfile
 import io
 import time
+import hashlib
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import yfinance as yf
+from yfinance.exceptions import YFPricesMissingError
 from datetime import datetime
 from pca_dax import yfinance_info as yfi
 from pca_dax import db
+from pca_dax import storage as st
+from pca_dax import http_cache
+from pca_dax import factor_risk as fr
 from pca_dax.common import FIRST_DATE, DATE_FORMAT
 
 
-def get_ff_factors():
-    url = 'https://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp/Europe_5_Factors_Daily_CSV.zip'
-
-    with urllib.request.urlopen(url) as response:
-        zip_data = response.read()
-
+def _read_ff_zip(zip_data: bytes) -> pd.DataFrame:
     zip_input = io.BytesIO(zip_data)
 
     with zipfile.ZipFile(zip_input, 'r') as zip_file:
@@ -28,16 +31,165 @@ def get_ff_factors():
         , format='%Y%m%d'
     )
 
+    return ff_df
+
+
+def _read_constituents_table(html: bytes) -> pd.DataFrame:
+    return pd.read_html(io.StringIO(html.decode('utf-8')), attrs={'id': 'constituents'})[0]
+
+
+def _read_first_table(html: bytes) -> pd.DataFrame:
+    return pd.read_html(io.StringIO(html.decode('utf-8')))[0]
+
+
+def get_ff_factors():
+    url = 'https://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp/Europe_5_Factors_Daily_CSV.zip'
+
+    # the archive is downloaded and parsed only when it changed on the server
+    ff_df = http_cache.get_cache().get(url, parse=_read_ff_zip)
+
     # cut older data, missing values are replaced with Python-native solution
     ff_df_cut = ff_df.loc[FIRST_DATE:].replace({-99.99: None})
 
     return ff_df_cut
 
 
+def preprocess_prices(prices: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drops any stocks that have more than 1% of the given time window missing, forward fills the remained stocks
+    :param prices: date x symbol price matrix, NaN where a price is missing
+    :return: the preprocessed prices
+    """
+    matrix = prices.to_numpy()
+    keep = np.count_nonzero(~np.isnan(matrix), axis=0) >= int(0.99 * len(prices))
+
+    data = prices.loc[:, keep]
+
+    if data.isna().any().any():
+        data = data.ffill()
+
+    return data
+
+
+def daily_change(prices: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param prices: preprocessed date x symbol prices
+    :return: the daily returns, without the days where any of the returns is missing
+    """
+    return prices.pct_change(1).dropna()
+
+
+def _period_bounds(index: pd.DatetimeIndex, freq) -> tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    Splits the sorted days into the periods of a given frequency
+    :param index: sorted dates of the daily returns
+    :param freq: a pandas offset or an alias, e.g. W-FRI, BQE or CustomBusinessMonthEnd(holidays=...), daily if None
+    :return: the period labels as resample would give them, periods without a day included,
+        and the position after the last day of every period
+    """
+    if freq is None:
+        return index, np.arange(1, len(index) + 1)
+
+    # a resample of the index alone, the returns themselves are never grouped
+    counts = pd.Series(np.ones(len(index), dtype=np.int64), index=index).resample(freq).sum()
+
+    return counts.index, np.cumsum(counts.to_numpy())
+
+
+def _cumulative_log_returns(returns: np.ndarray) -> np.ndarray:
+    """
+    :param returns: day x symbol simple returns, a missing return counts as a flat day
+    :return: the cumulative log-returns with a leading row of zeros, so that a period's log-return is
+        the difference between the rows at its bounds
+    """
+    cumulative = np.zeros((returns.shape[0] + 1, ) + returns.shape[1:])
+    np.cumsum(np.nan_to_num(np.log1p(returns), nan=0.0), axis=0, out=cumulative[1:])
+
+    return cumulative
+
+
+def aggregate_returns(
+        daily_returns: pd.DataFrame
+        , freq=pd.offsets.MonthEnd()
+        , log: bool = False
+        , risk_free: pd.Series = None
+) -> pd.DataFrame:
+    """
+    Compounds daily returns to any frequency in one pass: the daily returns are turned into cumulative
+    log-returns once, and every period's return is the difference of the two rows at its bounds.
+    Gives the same periods and labels as daily_returns.resample(freq) with a compounding aggregation,
+    a period without a day has a zero return
+    :param daily_returns: date x symbol daily simple returns
+    :param freq: a pandas offset or an alias, e.g. W-FRI, BQE or CustomBusinessMonthEnd(holidays=...),
+        the days are kept if None. Month end by default
+    :param log: True for log-returns, False for simple returns
+    :param risk_free: daily simple risk-free returns, the returns are in excess of the compounded risk-free
+        return of every period if given. Reindexed to the returns' days, a missing day counts as the previous one
+    :return: a period x symbol dataframe of the compounded returns
+    """
+    labels, ends = _period_bounds(daily_returns.index, freq)
+    starts = np.concatenate(([0], ends[:-1]))
+
+    cumulative = _cumulative_log_returns(daily_returns.to_numpy(dtype=np.float64))
+    period = cumulative[ends] - cumulative[starts]
+
+    if risk_free is not None:
+        rf_cumulative = _cumulative_log_returns(
+            risk_free.reindex(daily_returns.index).ffill().to_numpy(dtype=np.float64)
+        )
+        rf_period = (rf_cumulative[ends] - rf_cumulative[starts])[:, None]
+
+        if log:
+            period -= rf_period
+        else:
+            period = np.expm1(period) - np.expm1(rf_period)
+    elif not log:
+        period = np.expm1(period)
+
+    return pd.DataFrame(period, index=labels, columns=daily_returns.columns)
+
+
+def monthly_change(daily_returns: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param daily_returns: date x symbol daily returns
+    :return: the compounded monthly returns
+    """
+    return aggregate_returns(daily_returns, freq=pd.offsets.MonthEnd())
+
+
+def mean_var_table(returns: pd.DataFrame, info: pd.DataFrame, n_factors: int = 5) -> pd.DataFrame:
+    """
+    Creates a dataframe containing data about stocks' mean return and variance, and the respective sectors
+    :param returns: date x symbol returns of any frequency
+    :param info: the companies' info with at least the symbol and the sector columns
+    :param n_factors: number of principal components the returns are regressed on
+        to split the variance into the systematic and the idiosyncratic part
+    :return: a df with the mean, the vol, the idiosyncratic share of the variance and the sector of every stock
+    """
+    stds = returns.std()
+    means = returns.mean()
+
+    pca = PCA(data=returns)
+    regression = fr.regress_on_factors(returns, pca.transform(result=pca.fit(n_comp=n_factors)))
+
+    return (pd.DataFrame(
+            data={'mean': means, 'vol': stds, 'idio_share': 1 - regression.r_squared}
+            , columns=['mean', 'vol', 'idio_share']
+        ).reset_index()
+        .merge(
+            info[['symbol', 'sector']]
+            , left_on='index'
+            , right_on='symbol'
+        )[['symbol', 'mean', 'vol', 'idio_share', 'sector']]
+    )
+
+
 class DataHandler:
-    def __init__(self, index: str = 'DAX', tickers=None, start_date=FIRST_DATE, end_date=None):
+    def __init__(self, index: str = 'DAX', tickers=None, start_date=FIRST_DATE, end_date=None, storage=None):
         # Variables initiation
         self._index = index
+        # the backend the prices and the info are read from, the columnar snapshot if it has been built
+        self._storage = storage if storage is not None else st.get_default_storage()
         self._tickers = tickers
         self._start_date = start_date
         self._end_date = end_date
@@ -47,61 +199,73 @@ class DataHandler:
         self._companies_info = pd.DataFrame({})
         self._mean_std = pd.DataFrame({})
         self._stoxx_info = pd.DataFrame({})
+        self._info_failures = {}
+        self._history_failures = {}
+        # derived series shared by the repeated calls, dropped once the storage reports a new data version
+        self._derived = {}
+        self._derived_version = None
+        self._derived_lock = threading.Lock()
 
     # make the class check the database first for the tickers, instead of doing API calls
     def _is_index_in_db(self):
-        with db.create_connection() as conn:
+        with db.read_connection() as conn:
             c = conn.cursor()
 
             c.execute(
-                f"""
+                """
                     SELECT DISTINCT stock_index
                     FROM companies
-                    WHERE stock_index = '{self._index}'
+                    WHERE stock_index = ?
                 """
+                , (self._index, )
             )
 
             return bool(c.fetchone())
 
     def _get_constituents_from_db(self):
-        with db.create_connection() as conn:
+        with db.read_connection() as conn:
             c = conn.cursor()
 
             c.execute(
-                f"""
+                """
                     SELECT DISTINCT symbol
                     FROM companies
-                    WHERE stock_index = '{self._index}'
+                    WHERE stock_index = ?
                 """
+                , (self._index, )
             )
 
             return set([row[0] for row in c.fetchall()])
 
     def _scrape_constituents(self):
+        cache = http_cache.get_cache()
+
         if self._index == 'DAX':
-            dax = pd.read_html(
+            dax = cache.get(
                 'https://en.wikipedia.org/wiki/DAX'
-                , attrs={'id': 'constituents'}
-            )[0]['Ticker'].to_list()
+                , parse=_read_constituents_table
+            )['Ticker'].to_list()
 
-            mdax = pd.read_html(
+            mdax = cache.get(
                 'https://en.wikipedia.org/wiki/MDAX'
-                , attrs={'id': 'constituents'}
-            )[0]['Symbol'].to_list()
+                , parse=_read_constituents_table
+            )['Symbol'].to_list()
 
-            sdax = pd.read_html(
+            sdax = cache.get(
                 'https://en.wikipedia.org/wiki/SDAX'
-                , attrs={'id': 'constituents'}
-            )[0]['Symbol'].to_list()
+                , parse=_read_constituents_table
+            )['Symbol'].to_list()
 
             # iterates through the lists of tickers, checks if they have the suffix,
             # adds if they don't, leaves only the unique tickers eventually
             return set([x + '.DE' if '.DE' not in x else x for x in sum([dax, mdax, sdax], [])])
 
         elif self._index == 'STOXX':
-            stoxx_df = pd.read_html(
+            # the cached table is copied, since the columns are modified below
+            stoxx_df = cache.get(
                 'https://qontigo.com/index/sxxgv/?components=true'
-            )[0]
+                , parse=_read_first_table
+            ).copy()
 
             # Clean the data from the most common abbreviations
             stoxx_df['Company'] = (
@@ -138,44 +302,169 @@ class DataHandler:
         Fetches the data from Yahoo! Finance publicly available API for given tickers and date range
         :return: a pandas dataframe with given tickers and in long format
         """
+        tickers = self.get_tickers()
+
         df = yf.download(
-            tickers=self.get_tickers()
+            tickers=tickers
             , start=self._start_date
             , end=self._end_date
         )
 
+        if df.empty:
+            self._data = pd.DataFrame(columns=db.STOCK_COLUMNS)
+
+            return self._data
+
+        # a single ticker may come back without the symbols level in the columns
+        if not isinstance(df.columns, pd.MultiIndex):
+            df.columns = pd.MultiIndex.from_product([df.columns, list(tickers)])
+
         # removes the multiindex and move the symbols to a separate column
         self._data = df.stack().reset_index(names=['Date', 'Symbol'])
 
         return self._data
 
-    def fetch_info_from_api(self) -> pd.DataFrame:
+    def _fetch_ticker_history(self, ticker: str) -> pd.DataFrame:
+        """
+        :return: the ticker's history in the long format, empty if Yahoo has no prices in the date range
+        :raises Exception: if the download failed, e.g. on a network or an HTTP error
+        """
+        try:
+            # by default yfinance hides the errors and returns an empty frame, which looks like a missing history
+            history = yf.Ticker(ticker).history(
+                start=self._start_date
+                , end=self._end_date
+                , auto_adjust=False
+                , actions=False
+                , raise_errors=True
+            )
+        except YFPricesMissingError:
+            # Yahoo answered, there are just no prices in the range, e.g. before the listing
+            return pd.DataFrame(columns=db.STOCK_COLUMNS)
+
+        history.index = history.index.tz_localize(None)
+
+        return history.assign(Symbol=ticker).rename_axis('Date').reset_index()[db.STOCK_COLUMNS]
+
+    def fetch_history_from_api(self, max_workers: int = 1) -> pd.DataFrame:
+        """
+        Fetches the data ticker by ticker instead of a single bulk download,
+        unlike yf.download this is safe to be called from several threads at once.
+        The tickers whose download failed are left out and can be read with get_history_failures
+        :param max_workers: number of threads downloading the tickers concurrently
+        :return: a pandas dataframe in the same long format as fetch_stocks_from_api
+        """
+        frames = []
+
+        self._history_failures = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._fetch_ticker_history, ticker): ticker
+                for ticker in sorted(self.get_tickers())
+            }
+
+            for future, ticker in futures.items():
+                try:
+                    frames.append(future.result())
+                except Exception as e:
+                    self._history_failures[ticker] = e
+
+        frames = [frame for frame in frames if not frame.empty]
+
+        if not frames:
+            self._data = pd.DataFrame(columns=db.STOCK_COLUMNS)
+        else:
+            self._data = pd.concat(frames, ignore_index=True)
+
+        return self._data
+
+    def get_history_failures(self) -> dict:
+        """
+        :return: a dictionary of symbols whose history could not be fetched by the last fetch_history_from_api call,
+            mapped to the raised exceptions
+        """
+        return self._history_failures
+
+    def fetch_info_from_api(self, max_workers: int = yfi.DEFAULT_WORKERS) -> pd.DataFrame:
         """
         Fetches the info data from Yahoo! Finance publicly available API for given tickers
+        :param max_workers: number of threads fetching the info concurrently
         :return: a pandas dataframe with given tickers' info
         """
         col_list = ['symbol', 'shortName', 'exchange', 'industry', 'sector', 'marketCap', 'bookValue', 'beta']
         results = []
-        tickers = self.get_tickers()
 
-        for i, ticker in enumerate(tickers):
-            # tries if info about the company is available, pass if not
-            try:
-                symbol = yfi.Ticker(ticker)
-                info = symbol.info
+        self._info_failures = {}
 
-                results.append({key: info[key] if key in info else None for key in col_list})
-            except:
-                pass
+        for result in yfi.fetch_infos(self.get_tickers(), max_workers=max_workers):
+            if result.error is None:
+                results.append({key: result.info[key] if key in result.info else None for key in col_list})
+            else:
+                self._info_failures[result.symbol] = result.error
 
-            # TODO: handle the requests in better fashion
-            # time.sleep(3)
+        if self._info_failures:
+            print(f'Failed to fetch info for {len(self._info_failures)} symbols: '
+                  f'{", ".join(sorted(self._info_failures))}')
 
-        self._companies_info = pd.DataFrame(results)
+        self._companies_info = pd.DataFrame(results, columns=col_list)
         self._companies_info['stock_index'] = self._index
 
         return self._companies_info
 
+    def get_info_failures(self) -> dict:
+        """
+        :return: a dictionary of symbols whose info could not be fetched by the last fetch_info_from_api call,
+            mapped to the raised exceptions
+        """
+        return self._info_failures
+
+    def _get_date_bounds(self) -> tuple[int, int]:
+        # sets today's date if the end date is missing or if it is in the future,
+        # resolved on every call, so a long-living handler sees the days added later
+        end_date = self._end_date
+
+        if end_date is None or datetime.strptime(end_date, DATE_FORMAT) > datetime.today():
+            end_date = datetime.today().strftime(DATE_FORMAT)
+
+        return db.to_day_number(self._start_date), db.to_day_number(end_date)
+
+    def get_data_version(self):
+        """
+        :return: the storage's data version, changes whenever the stored data change
+        """
+        return self._storage.get_version()
+
+    def _memoize(self, key: tuple, compute):
+        """
+        Returns the derived series cached under a given key and the current window, computes it if it is missing.
+        The whole cache is dropped as soon as the storage's data version changes, e.g. after update-db,
+        so a repeated call costs one PRAGMA data_version until the data actually change.
+        The cached series are shared, so they must not be modified.
+        This cache serves the direct users of a handler, such as the scripts and the engines' default data.
+        The Dash apps read through market_data.MarketDataStore, which keeps and invalidates its own items,
+        its handler only caches what the store asks it for, e.g. the companies' info.
+        """
+        key = key + self._get_date_bounds()
+        version = self.get_data_version()
+
+        with self._derived_lock:
+            if version != self._derived_version:
+                self._derived.clear()
+                self._derived_version = version
+
+            if key in self._derived:
+                return self._derived[key]
+
+        value = compute()
+
+        with self._derived_lock:
+            # a result computed while the data changed is returned, but not cached under the new version
+            if version == self._derived_version:
+                self._derived[key] = value
+
+        return value
+
     def fetch_stocks_from_db(self, price_type: str = 'adj_close', wide_format: bool = True) -> pd.DataFrame:
         """
         Fetches data from database for given stocks and given timeframe
@@ -185,31 +474,58 @@ class DataHandler:
             True if stocks should be as columns, with one price type on a given date.
         :return: 
         """
-        # sets today's date if the end date is missing or if it is in the future
-        if self._end_date is None or datetime.strptime(self._end_date, DATE_FORMAT) > datetime.today():
-            self._end_date = datetime.today().strftime(DATE_FORMAT)
-
-        # creates connection and reads stocks data with function arguments
-        with db.create_connection() as conn:
-            self._data = pd.read_sql(
-                f"""
-                    SELECT date, symbol, {price_type}
-                    FROM stocks
-                    WHERE date BETWEEN '{self._start_date}' AND '{self._end_date}'
-                    AND symbol IN {tuple(self.get_tickers())}
-                """
-                , con=conn
-                , parse_dates={'date': {'format': '%Y-%m-%d'}}
-                , index_col='date'
-            )
-
         if wide_format:
-            self._data = (self._data
-                          .pivot_table(index='date', values=f'{price_type}', columns='symbol')
-                          .rename_axis(columns=None))
+            matrix, dates, symbols = self.fetch_price_matrix(price_type=price_type)
+            self._data = pd.DataFrame(matrix, index=dates, columns=symbols)
+
+            return self._data
+
+        columns = db.parse_price_columns(price_type)
+        start_day, end_day = self._get_date_bounds()
+
+        arrays = self._storage.read_prices(self.get_tickers(), start_day, end_day, columns)
+
+        # dates are stored as day numbers
+        self._data = pd.DataFrame(
+            {col: arrays[col] for col in ['symbol', *columns]}
+            , index=db.from_day_numbers(arrays['date']).rename('date')
+        )
 
         return self._data
 
+    def fetch_price_matrix(self, price_type: str = 'adj_close', dtype=np.float64) \
+            -> tuple[np.ndarray, pd.DatetimeIndex, pd.Index]:
+        """
+        Reads one price type straight into a date x symbol matrix, without a long dataframe and a pivot.
+        The rows come sorted by symbol and date, so every symbol fills one column of the preallocated matrix.
+        :param price_type: one price type, such as low, high, close, adj_close
+        :param dtype: dtype of the matrix, np.float64 or np.float32
+        :return: a tuple of the matrix, with NaN where a price is missing, its dates and its symbols
+        """
+        columns = db.parse_price_columns(price_type)
+
+        if len(columns) != 1:
+            raise ValueError('The price matrix can be built for one price type only')
+
+        start_day, end_day = self._get_date_bounds()
+        arrays = self._storage.read_prices(self.get_tickers(), start_day, end_day, columns, dropna=True)
+
+        row_symbols = arrays['symbol']
+        n_rows = len(row_symbols)
+
+        if n_rows == 0:
+            return np.empty((0, 0), dtype=dtype), db.from_day_numbers([]).rename('date'), pd.Index([])
+
+        # a new column starts wherever the symbol changes
+        starts = np.flatnonzero(np.r_[True, row_symbols[1:] != row_symbols[:-1]])
+        col_idx = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n_rows]))
+        unique_days, row_idx = np.unique(arrays['date'], return_inverse=True)
+
+        matrix = np.full((len(unique_days), len(starts)), np.nan, dtype=dtype)
+        matrix[row_idx, col_idx] = arrays[columns[0]]
+
+        return matrix, db.from_day_numbers(unique_days).rename('date'), pd.Index(row_symbols[starts].tolist())
+
     def fetch_info_from_db(self, tickers=None) -> pd.DataFrame:
         """
         Fetches data about companies from an initialised database.
@@ -217,205 +533,544 @@ class DataHandler:
         :return: returns a Dataframe with the desired companies' information
         """
         if tickers is None:
-            tckrs = self.get_tickers()
+            self._companies_info = self._memoize(('info', ), lambda: self._storage.read_info(self.get_tickers()))
         else:
-            tckrs = tickers
-
-        with db.create_connection() as conn:
-            self._companies_info = pd.read_sql(
-                f"""
-                    SELECT *
-                    FROM companies
-                    WHERE symbol IN {tuple(tckrs)} AND sector IS NOT NULL
-                """
-                , con=conn
-            )
+            self._companies_info = self._storage.read_info(tickers)
 
         return self._companies_info
 
-    def preprocess(self, price_type='adj_close') -> pd.DataFrame:
+    def preprocess(self, price_type='adj_close', dtype=np.float64) -> pd.DataFrame:
         """
-        Initialises the index as a datetime object,
+        Loads the price matrix,
         drops any stocks that have more than 1% of whole time window missing,
         forward fills the remained stocks
-
+        :param price_type: one price type, such as low, high, close, adj_close
+        :param dtype: dtype of the prices, np.float64 or np.float32
         :return: Returns a preprocessed pd.DataFrame object
         """
+        def load_preprocessed():
+            matrix, dates, symbols = self.fetch_price_matrix(price_type=price_type, dtype=dtype)
 
-        data = self.fetch_stocks_from_db(price_type=price_type, wide_format=True)
-
-        data.index = pd.to_datetime(data.index)
+            return preprocess_prices(pd.DataFrame(matrix, index=dates, columns=symbols))
 
-        if isinstance(data, pd.DataFrame):
-            data = data.dropna(
-                axis=1
-                , thresh=int(0.99*len(data))
-            )
-        elif isinstance(data, pd.Series):
-            data = data.dropna()
-
-        if data.isna().any().any():
-            data = data.ffill()
-
-        return data
+        return self._memoize(('preprocessed', price_type, np.dtype(dtype).name), load_preprocessed)
 
-    def create_daily_change(self) -> pd.DataFrame:
+    def create_daily_change(self, dtype=np.float64, price_type='adj_close') -> pd.DataFrame:
         """
         Creates return series from wide stocks data (please choose one price type, default is adj_close)
+        :param dtype: dtype of the returns, np.float64 or np.float32
+        :param price_type: one price type, such as low, high, close, adj_close
         :return: a dataframe with returns for given price type
         """
-        data = self.preprocess()
-        dly_chg = data.pct_change(1)
-        self._dly_chg = dly_chg.dropna()
+        self._dly_chg = self._memoize(
+            ('daily', price_type, np.dtype(dtype).name)
+            , lambda: daily_change(self.preprocess(price_type=price_type, dtype=dtype))
+        )
 
         return self._dly_chg
 
-    def create_monthly_change(self) -> pd.DataFrame:
+    def create_period_change(
+            self
+            , freq=pd.offsets.MonthEnd()
+            , log: bool = False
+            , risk_free: pd.Series = None
+            , price_type='adj_close'
+    ) -> pd.DataFrame:
         """
-        Converts daily returns to monthly returns
+        Compounds the daily returns to a given frequency, see aggregate_returns
+        :param freq: a pandas offset or an alias, e.g. W-FRI, BQE or CustomBusinessMonthEnd(holidays=...)
+        :param log: True for log-returns, False for simple returns
+        :param risk_free: daily simple risk-free returns, the returns are in excess of them if given
+        :param price_type: one price type, such as low, high, close, adj_close
+        :return: a period x symbol dataframe of the compounded returns
         """
-        if self._dly_chg.empty:
-            _dly_chg = self.create_daily_change()
-        else:
-            _dly_chg = self._dly_chg
+        def compute():
+            return aggregate_returns(
+                self.create_daily_change(price_type=price_type)
+                , freq=freq
+                , log=log
+                , risk_free=risk_free
+            )
+
+        # the excess returns depend on a whole series, they are computed on every call
+        if risk_free is not None:
+            return compute()
+
+        return self._memoize(('period', price_type, freq, log), compute)
 
-        self._mth_chg = _dly_chg.resample('M').agg(lambda x: (x + 1).prod() - 1)
+    def create_monthly_change(self, price_type='adj_close') -> pd.DataFrame:
+        """
+        Converts daily returns to monthly returns
+        :param price_type: one price type, such as low, high, close, adj_close
+        """
+        self._mth_chg = self.create_period_change(freq=pd.offsets.MonthEnd(), price_type=price_type)
 
         return self._mth_chg
 
-    def create_mean_var_df(self, daily_freq: bool = True) -> pd.DataFrame:
+    def create_mean_var_df(self, daily_freq: bool = True, n_factors: int = 5) -> pd.DataFrame:
         """
         Create a dataframe containing data about stocks' mean return and variance, and the respective sectors
         :param daily_freq: boolean, True if you want to use daily price change frequency, False if monthly
-        :return: returns a df with given frequency's mean, variance and sectors
+        :param n_factors: number of principal components the returns are regressed on
+            to split the variance into the systematic and the idiosyncratic part
+        :return: returns a df with given frequency's mean, variance, idiosyncratic share of the variance and sectors
         """
-        if daily_freq:
-            rts = self.create_daily_change()
-        else:
-            rts = self.create_monthly_change()
-
-        stds = rts.std()
-        means = rts.mean()
-
-        self._mean_std = (pd.DataFrame(
-                data={'mean': means, 'vol': stds}
-                , columns=['mean', 'vol']
-            ).reset_index()
-            .merge(
-                self.fetch_info_from_db()[['symbol', 'sector']]
-                , left_on='index'
-                , right_on='symbol'
-            )[['symbol', 'mean', 'vol', 'sector']]
-        )
+        def load_mean_var():
+            if daily_freq:
+                rts = self.create_daily_change()
+            else:
+                rts = self.create_monthly_change()
+
+            return mean_var_table(rts, self.fetch_info_from_db(), n_factors=n_factors)
+
+        self._mean_std = self._memoize(('mean_var', 'daily' if daily_freq else 'monthly', n_factors), load_mean_var)
 
         return self._mean_std
 
 
+# solvers decomposing the correlation or covariance matrix
+MATRIX_SOLVERS = ('full', 'truncated', 'randomized')
+# 'svd' works on the standardized returns directly and never forms the N x N matrix
+PCA_SOLVERS = MATRIX_SOLVERS + ('svd', )
+
+# randomized solver: extra dimensions of the sampled subspace, the cap on the power iterations
+# and the default residual tolerance relative to the largest eigenvalue
+RANDOMIZED_OVERSAMPLES = 10
+RANDOMIZED_MAX_ITER = 50
+RANDOMIZED_TOL = float(np.sqrt(np.finfo(np.float64).eps))
+
+
+def _eigh_full(mtrx: np.ndarray, n_comp: int) -> tuple[np.ndarray, np.ndarray]:
+    eigvls, eigvecs = np.linalg.eigh(mtrx)
+
+    idx = np.argsort(eigvls)[::-1]
+
+    return eigvls[idx], eigvecs[:, idx]
+
+
+def _eigh_truncated(mtrx: np.ndarray, n_comp: int, tol: float = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Computes the leading n_comp eigenpairs with the Lanczos method"""
+    try:
+        from scipy.sparse.linalg import eigsh
+    except ImportError as e:
+        raise ImportError("The 'truncated' solver requires scipy, install it with \"pip install scipy\"") from e
+
+    # Lanczos needs fewer wanted eigenpairs than the matrix dimension
+    if n_comp >= mtrx.shape[0] - 1:
+        return _eigh_full(mtrx, n_comp)
+
+    eigvls, eigvecs = eigsh(mtrx, k=n_comp, which='LA', tol=tol)
+
+    idx = np.argsort(eigvls)[::-1]
+
+    return eigvls[idx], eigvecs[:, idx]
+
+
+def _eigh_randomized(mtrx: np.ndarray, n_comp: int, tol: float = 0
+                     , random_state=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the leading n_comp eigenpairs with a randomized range finder: a random subspace is refined
+    by power iterations, and the matrix projected onto it is decomposed after every iteration,
+    until the residual ||A v - l v|| of every wanted Ritz pair is within tol of the largest eigenvalue.
+    The power iterations converge slowly when the wanted eigenvalues lie in a flat part of the spectrum,
+    if they do not converge within RANDOMIZED_MAX_ITER iterations the whole matrix is decomposed instead
+    """
+    rng = np.random.default_rng(random_state)
+    n_dim = mtrx.shape[0]
+    n_sample = min(n_dim, n_comp + RANDOMIZED_OVERSAMPLES)
+    tol = tol or RANDOMIZED_TOL
+
+    q, _ = np.linalg.qr(mtrx @ rng.standard_normal((n_dim, n_sample)))
+
+    for _ in range(RANDOMIZED_MAX_ITER):
+        mtrx_q = mtrx @ q
+        ritz_values, small_eigvecs = np.linalg.eigh(q.T @ mtrx_q)
+
+        idx = np.argsort(ritz_values)[::-1][:n_comp]
+        eigvls, small_eigvecs = ritz_values[idx], small_eigvecs[:, idx]
+        eigvecs = q @ small_eigvecs
+
+        residuals = np.linalg.norm(mtrx_q @ small_eigvecs - eigvecs * eigvls, axis=0)
+
+        if np.max(residuals) <= tol * np.abs(eigvls[0]):
+            return eigvls, eigvecs
+
+        q, _ = np.linalg.qr(mtrx_q)
+
+    warnings.warn(
+        f'The randomized solver did not converge to tol={tol:g} in {RANDOMIZED_MAX_ITER} iterations, '
+        f'the whole matrix is decomposed instead'
+        , RuntimeWarning
+        , stacklevel=3
+    )
+
+    return _eigh_full(mtrx, n_comp)
+
+
+def decompose(mtrx: np.ndarray, n_comp: int, solver: str = 'full', tol: float = 0
+              , random_state=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the eigenpairs of a symmetric matrix in descending order of the eigenvalues
+    :param mtrx: symmetric N x N matrix
+    :param n_comp: number of wanted eigenpairs
+    :param solver: 'full' decomposes the whole matrix and returns all eigenpairs,
+        'truncated' (Lanczos) and 'randomized' compute only the leading n_comp ones
+    :param tol: convergence tolerance of the 'truncated' and 'randomized' solvers. For 'truncated' it is
+        the relative accuracy of the eigenvalues, 0 means machine precision. For 'randomized' it is the residual
+        norm of the eigenpairs relative to the largest eigenvalue, 0 means RANDOMIZED_TOL
+    :param random_state: seed of the 'randomized' solver
+    :return: a tuple of the eigenvalues and the eigenvectors as columns
+    """
+    mtrx = np.asarray(mtrx, dtype=np.float64)
+
+    if solver == 'full':
+        return _eigh_full(mtrx, n_comp)
+    elif solver == 'truncated':
+        return _eigh_truncated(mtrx, n_comp, tol=tol)
+    elif solver == 'randomized':
+        return _eigh_randomized(mtrx, n_comp, tol=tol, random_state=random_state)
+    else:
+        raise ValueError(f"The solver argument should be one of {', '.join(MATRIX_SOLVERS)}")
+
+
+def standardize_returns(returns: np.ndarray, cov_base: bool = False) -> np.ndarray:
+    """
+    Demeans and scales a T x N returns matrix, so that X.T @ X is its covariance or correlation matrix
+    :param returns: T x N array of returns
+    :param cov_base: scale for the covariance matrix, for the correlation matrix otherwise
+    :return: a contiguous float64 T x N array
+    """
+    x = np.array(returns, dtype=np.float64, order='C')
+    x -= x.mean(axis=0)
+
+    if cov_base:
+        x /= np.sqrt(len(x) - 1)
+    else:
+        x /= np.sqrt(np.einsum('ij,ij->j', x, x))
+
+    return x
+
+
+def decompose_returns(x: np.ndarray, n_comp: int) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Computes the eigenpairs of X.T @ X through a thin SVD of the standardized returns X,
+    by decomposing the T x T Gram matrix when there are fewer days than stocks and the N x N matrix otherwise
+    :param x: standardized T x N returns, as returned by standardize_returns
+    :param n_comp: number of wanted eigenpairs
+    :return: a tuple of the N eigenvalues in descending order, the N x N or N x r eigenvectors as columns
+        and the total variance
+    """
+    n_days, n_stocks = x.shape
+    total_variance = np.einsum('ij,ij->', x, x)
+
+    # the Gram matrix has at most T - 1 non-zero eigenvalues, the rest of the loadings is not identified by it
+    if n_days >= n_stocks or n_comp > n_days - 1:
+        eigvls, eigvecs = _eigh_full(x.T @ x, n_comp)
+
+        return eigvls, eigvecs, total_variance
+
+    gram_eigvls, u = _eigh_full(x @ x.T, n_comp)
+    rank = n_days - 1
+
+    # right singular vectors: v = X.T u / s, with s ** 2 being the eigenvalues
+    eigvecs = (x.T @ u[:, :rank]) / np.sqrt(gram_eigvls[:rank])
+    eigvls = np.zeros(n_stocks)
+    eigvls[:rank] = gram_eigvls[:rank]
+
+    return eigvls, eigvecs, total_variance
+
+
+# number of fitted results kept by the PCA results cache
+PCA_CACHE_SIZE = 64
+
+
+def fingerprint(data: pd.DataFrame) -> str:
+    """
+    Hashes the values, the columns and the index of a dataframe
+    :param data: a dataframe
+    :return: a hex digest identifying the data
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(data.to_numpy()).tobytes())
+    digest.update(str(data.dtypes.tolist()).encode('utf-8'))
+    digest.update('\x1f'.join(map(str, data.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data.index, index=False).to_numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+class PCAResult:
+    """
+    Immutable result of PCA.fit. It holds no reference to the model, its arrays are read-only
+    and its attributes cannot be reassigned, so one result can be shared by any number of threads.
+    """
+    __slots__ = ('loadings', 'eigenvalues', 'explained_variance', 'cov_base', 'window', 'solver', 'fingerprint'
+                 , 'tol', 'random_state')
+
+    def __init__(self, loadings: pd.DataFrame, eigenvalues: np.ndarray, explained_variance: np.ndarray
+                 , cov_base: bool, window: tuple, solver: str, fingerprint: str, tol: float = 0
+                 , random_state=None):
+        """
+        :param loadings: N x n_comp loadings, the tickers as the index and the components as the columns
+        :param eigenvalues: all the computed eigenvalues in descending order
+        :param explained_variance: share of the total variance explained by each retained component
+        :param cov_base: True if the covariance matrix was decomposed, False for the correlation matrix
+        :param window: first and last date of the fitted data
+        :param solver: eigensolver used for the fit
+        :param fingerprint: fingerprint of the fitted data
+        :param tol: convergence tolerance of the solver
+        :param random_state: seed of the solver
+        """
+        values = np.array(loadings.to_numpy(), dtype=np.float64)
+        values.flags.writeable = False
+
+        frozen = {
+            'loadings': pd.DataFrame(values, index=loadings.index.copy(), columns=loadings.columns.copy(), copy=False)
+            , 'eigenvalues': np.array(eigenvalues, dtype=np.float64)
+            , 'explained_variance': np.array(explained_variance, dtype=np.float64)
+            , 'cov_base': cov_base
+            , 'window': window
+            , 'solver': solver
+            , 'fingerprint': fingerprint
+            , 'tol': tol
+            , 'random_state': random_state
+        }
+
+        for name, value in frozen.items():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PCAResult is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('PCAResult is immutable')
+
+    def __repr__(self):
+        return (f'PCAResult(basis={self.basis!r}, n_comp={self.n_comp}, n_stocks={len(self.loadings)}'
+                f', window={self.window!r}, solver={self.solver!r})')
+
+    @property
+    def basis(self) -> str:
+        return 'covariance' if self.cov_base else 'correlation'
+
+    @property
+    def n_comp(self) -> int:
+        return self.loadings.shape[1]
+
+    @property
+    def key(self) -> tuple:
+        """Identifies the result in the PCA results cache"""
+        return self.fingerprint, self.solver, self.tol, self.random_state, self.cov_base, self.n_comp
+
+
 class PCA:
-    def __init__(self, data: pd.DataFrame = None):
+    # fitted results shared by all instances, keyed by the data's fingerprint and the fit parameters
+    _results_cache = OrderedDict()
+    _results_cache_lock = threading.Lock()
+    _results_cache_size = PCA_CACHE_SIZE
+
+    def __init__(self, data: pd.DataFrame = None, solver: str = 'full', tol: float = 0, random_state=None):
+        """
+        :param data: daily returns, the whole DAX family since FIRST_DATE if not given
+        :param solver: eigensolver, one of PCA_SOLVERS, see decompose() and decompose_returns()
+        :param tol: convergence tolerance of the 'truncated' and 'randomized' solvers
+        :param random_state: seed of the 'randomized' solver
+        """
         # TODO: add a possibility to handle the different number of components in different methods
         if data is None:
             self._data = DataHandler().create_daily_change()
         else:
             self._data = data
 
+        if solver not in PCA_SOLVERS:
+            raise ValueError(f"The solver argument should be one of {', '.join(PCA_SOLVERS)}")
+
+        self._solver = solver
+        self._tol = tol
+        self._random_state = random_state
+
+        # the model is never modified after this point, all the fitted state lives in PCAResult objects
         self._tickers = self._data.columns
-        self._components = pd.DataFrame([])
-        self._eigenvalues = None
-        self._explained_variance = None
-        self._loadings_sectors = pd.DataFrame([])
-        self._transposed_loadings = pd.DataFrame([])
-        self._factors = pd.DataFrame({})
+        self._fingerprint = fingerprint(self._data)
 
-    def fit(self, cov_base: bool = False, n_comp: int = 10) -> pd.DataFrame:
+        if isinstance(self._data.index, pd.DatetimeIndex) and len(self._data.index):
+            self._window = (self._data.index[0], self._data.index[-1])
+        else:
+            self._window = None
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        """Drops all the cached results, e.g. once the companies' sectors changed"""
+        with cls._results_cache_lock:
+            cls._results_cache.clear()
+
+    def _memoize(self, key: tuple, compute):
         """
-        Fit a PCA model to the given data
-        :param cov_base: use covariance matrix as an underlying base for PCA
-        :param n_comp: number of components to retain after fitting
-        :return: returns a Dataframe containing data about components, where the columns are the components and
-            the indices are the given tickers.
+        Returns the cached result for a given key, computes and caches it if it is missing,
+        the least recently used results are evicted once the cache is full.
+        The cached results are shared, so they must not be modified.
         """
-        df = self._data
+        with self._results_cache_lock:
+            if key in self._results_cache:
+                self._results_cache.move_to_end(key)
+
+                return self._results_cache[key]
 
-        df_demeaned = df - df.mean(axis=0)
+        result = compute()
+
+        with self._results_cache_lock:
+            self._results_cache[key] = result
+            self._results_cache.move_to_end(key)
+
+            while len(self._results_cache) > self._results_cache_size:
+                self._results_cache.popitem(last=False)
+
+        return result
+
+    def _fit(self, cov_base: bool, n_comp: int) -> PCAResult:
+        df = self._data
 
-        if cov_base:
-            mtrx = df_demeaned.cov()
+        if self._solver == 'svd':
+            sorted_eigvls, sorted_eigvecs, total_variance = decompose_returns(
+                standardize_returns(df.to_numpy(), cov_base=cov_base)
+                , n_comp=n_comp
+            )
         else:
-            mtrx = df_demeaned.corr()
+            df_demeaned = df - df.mean(axis=0)
 
-        eigvls, eigvecs = np.linalg.eigh(mtrx)
+            if cov_base:
+                mtrx = df_demeaned.cov()
+            else:
+                mtrx = df_demeaned.corr()
+
+            sorted_eigvls, sorted_eigvecs = decompose(
+                mtrx
+                , n_comp=n_comp
+                , solver=self._solver
+                , tol=self._tol
+                , random_state=self._random_state
+            )
 
-        idx = np.argsort(eigvls)[::-1]
-        sorted_eigvls = eigvls[idx]
-        sorted_eigvecs = eigvecs[:, idx]
+            # the trace equals the sum of all eigenvalues, so the truncated solvers report the same shares
+            total_variance = np.trace(mtrx)
 
         components_names = ['PC' + str(pc) for pc in range(1, n_comp + 1)]
 
-        self._components = pd.DataFrame(
+        components = pd.DataFrame(
             sorted_eigvecs[:, :n_comp]
             , columns=components_names
             , index=self._tickers
         )
 
-        self._explained_variance = sorted_eigvls[:n_comp] / sorted_eigvls[:n_comp].sum()
-        self._eigenvalues = sorted_eigvls
+        return PCAResult(
+            loadings=components
+            , eigenvalues=sorted_eigvls
+            , explained_variance=sorted_eigvls[:n_comp] / total_variance
+            , cov_base=cov_base
+            , window=self._window
+            , solver=self._solver
+            , fingerprint=self._fingerprint
+            , tol=self._tol
+            , random_state=self._random_state
+        )
 
-        return self._components
+    def fit(self, cov_base: bool = False, n_comp: int = 10) -> PCAResult:
+        """
+        Fit a PCA model to the given data, served from the results cache if the same data was fitted already
+        :param cov_base: use covariance matrix as an underlying base for PCA
+        :param n_comp: number of components to retain after fitting
+        :return: returns an immutable PCAResult, its loadings are a Dataframe where the columns are the components
+            and the indices are the given tickers.
+        """
+        return self._memoize(
+            (self._fingerprint, self._solver, self._tol, self._random_state, 'fit', cov_base, n_comp)
+            , lambda: self._fit(cov_base=cov_base, n_comp=n_comp)
+        )
 
-    def combine_loadings_sectors(self, cov_base: bool = False, n_comp: int = 10) -> pd.DataFrame:
+    def _get_sectors(self, result: PCAResult) -> pd.DataFrame:
+        def read_sectors():
+            with db.read_connection() as conn:
+                db.load_symbol_filter(conn, result.loadings.index)
+
+                return pd.read_sql(
+                    """
+                        SELECT c.symbol, c.sector
+                        FROM companies AS c
+                        JOIN temp.symbol_filter AS f ON c.symbol = f.symbol
+                    """
+                    , con=conn
+                ).set_index('symbol')
+
+        # the sectors depend on the tickers only, not on the fit parameters
+        return self._memoize(('sectors', result.fingerprint), read_sectors)
+
+    def combine_loadings_sectors(self, cov_base: bool = False, n_comp: int = 10
+                                 , result: PCAResult = None) -> pd.DataFrame:
         """
         Combine components' loadings with respective tickers' sectors
         :param cov_base: use covariance matrix as an underlying base for PCA, passes it further to fit method
         :param n_comp: number of components to retain after fitting, passes it further to fit method
-        :return: return a Dataframe
+        :param result: an already fitted result, cov_base and n_comp are ignored if given
+        :return: return a Dataframe, a copy owned by the caller
         """
-        ldngs = self.fit(cov_base=cov_base, n_comp=n_comp)
-        tickers = self._components.index.tolist()
-
-        with db.create_connection() as conn:
-            sectors = pd.read_sql(
-                f"""
-                    SELECT symbol, sector
-                    FROM companies
-                    WHERE symbol IN {tuple(tickers)}
-                """
-                , con=conn
+        if result is None:
+            result = self.fit(cov_base=cov_base, n_comp=n_comp)
+
+        loadings_sectors = self._memoize(
+            ('loadings_sectors', self._fingerprint) + result.key
+            , lambda: pd.concat(
+                [result.loadings, self._get_sectors(result)]
+                , axis=1
+                , join='inner'
             )
-
-        self._loadings_sectors = pd.concat(
-            [ldngs, sectors.set_index('symbol')]
-            , axis=1
-            , join='inner'
         )
 
-        return self._loadings_sectors
+        return loadings_sectors.copy()
 
-    def transpose_loadings_sectors(self, cov_base: bool = False, n_comp: int = 10) -> pd.DataFrame:
+    def transpose_loadings_sectors(self, cov_base: bool = False, n_comp: int = 10
+                                   , result: PCAResult = None) -> pd.DataFrame:
         """
         Transpose the Dataframe containing the loadings and their respective sectors
         :param cov_base: use covariance matrix as an underlying base for PCA,
             passes it further to combine_loadings_sectors method
         :param n_comp: number of components to retain after fitting,
             passes it further to combine_loadings_sectors method
-        :return: return a Dataframe
+        :param result: an already fitted result, cov_base and n_comp are ignored if given
+        :return: return a Dataframe, a copy owned by the caller
         """
-        ldngs = self.combine_loadings_sectors(cov_base=cov_base, n_comp=n_comp).reset_index()
-
-        self._transposed_loadings = pd.melt(
-            ldngs.sort_values(by=['sector'])
-            , id_vars=['index', 'sector']
-            , value_vars=ldngs[ldngs.columns.difference(['index', 'sector'])].columns.tolist()
-            , var_name='component'
-            , value_name='loading'
-            , ignore_index=False
-        )
-
-        return self._transposed_loadings
-
-    def transform(self, cov_base: bool = False, n_comp: int = 10):
-        loadings = self.fit(cov_base=cov_base, n_comp=n_comp)
+        if result is None:
+            result = self.fit(cov_base=cov_base, n_comp=n_comp)
+
+        def melt_loadings():
+            ldngs = self.combine_loadings_sectors(result=result).reset_index()
+
+            return pd.melt(
+                ldngs.sort_values(by=['sector'])
+                , id_vars=['index', 'sector']
+                , value_vars=ldngs[ldngs.columns.difference(['index', 'sector'])].columns.tolist()
+                , var_name='component'
+                , value_name='loading'
+                , ignore_index=False
+            )
 
-        self._factors = self._data.dot(loadings)
+        return self._memoize(('transposed_loadings', self._fingerprint) + result.key, melt_loadings).copy()
 
-        return self._factors
+    def transform(self, cov_base: bool = False, n_comp: int = 10, result: PCAResult = None) -> pd.DataFrame:
+        """
+        Projects the fitted data onto the components
+        :param cov_base: use covariance matrix as an underlying base for PCA, passes it further to fit method
+        :param n_comp: number of components to retain after fitting, passes it further to fit method
+        :param result: an already fitted result, cov_base and n_comp are ignored if given
+        :return: return a Dataframe of factor scores, a copy owned by the caller
+        """
+        if result is None:
+            result = self.fit(cov_base=cov_base, n_comp=n_comp)
+
+        # the scores depend on both the model's own data and the result, which may come from another model
+        return self._memoize(
+            ('transform', self._fingerprint) + result.key
+            , lambda: self._data.dot(result.loadings)
+        ).copy()
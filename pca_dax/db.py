@@ -1,10 +1,56 @@
+import os
+import queue
+import hashlib
+import itertools
+import threading
 import pandas as pd
 import sqlite3
 import click
-from flask import current_app, g
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app, g, has_app_context
 from pca_dax import data_handler as dh
+from pca_dax import storage as st
+from pca_dax import pca_engines as pe
 from pca_dax.common import FIRST_DATE, DATE_FORMAT
-from datetime import datetime
+from datetime import datetime, timedelta
+
+
+DEFAULT_DATABASE = os.path.join('instance', 'pca_project.sqlite')
+
+# number of read-only connections kept open for the Dash worker threads
+READ_POOL_SIZE = 4
+
+# applied to every connection, journal_mode is persistent and is set once by the writer
+CONNECTION_PRAGMAS = {
+    'mmap_size': 256 * 1024 * 1024
+    , 'cache_size': -64 * 1024  # negative values are in KiB
+    , 'synchronous': 'NORMAL'
+    , 'temp_store': 'MEMORY'
+    , 'busy_timeout': 30 * 1000
+}
+
+# number of rows sent to the database in one executemany call
+BULK_BATCH_SIZE = 5000
+
+# backfill defaults: tickers per download, years per date slice, concurrent downloads
+# and concurrent tickers within each download
+BACKFILL_CHUNK_SIZE = 20
+BACKFILL_SLICE_YEARS = 3
+BACKFILL_WORKERS = 4
+BACKFILL_TICKER_WORKERS = 4
+
+# version of the storage layout, stored in the database's user_version pragma
+SCHEMA_VERSION = 2
+
+# dates are stored in the stocks table as the number of days since the unix epoch
+EPOCH = pd.Timestamp('1970-01-01')
+
+# columns of the stocks table that can be requested by the readers
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'adj_close', 'volume')
+
+STOCK_COLUMNS = ['Date', 'Symbol', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
 
 
 def get_db():
@@ -26,20 +72,249 @@ def close_db(e=None):
         db.close()
 
 
-def create_connection(db='instance/pca_project.sqlite') -> sqlite3.connect:
+class ConnectionManager:
+    """
+    Owns the connections to the sqlite database: a small pool of read-only connections shared by the
+    Dash worker threads, a single dedicated connection for the ETL writes and one probing the data version.
+    The database runs in WAL mode, so the readers do not block on the writer and vice versa.
+    :param database: path to the database, resolved from the Flask config if not given
+    :param pool_size: maximum number of read-only connections
+    """
+    def __init__(self, database: str = None, pool_size: int = READ_POOL_SIZE):
+        self._database = database
+        self._pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._writer = None
+        self._probe = None
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def get_database(self) -> str:
+        """
+        :return: the configured database path, falls back to the app's DATABASE config,
+            the PCA_DATABASE environment variable and the default instance path in this order
+        """
+        if self._database is not None:
+            return self._database
+
+        if has_app_context():
+            return current_app.config['DATABASE']
+
+        return os.environ.get('PCA_DATABASE', DEFAULT_DATABASE)
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        database = self.get_database()
+
+        if read_only:
+            uri = f'file:{pathname2url(os.path.abspath(database))}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+            conn.execute("""PRAGMA journal_mode = WAL""")
+
+        for pragma, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f"""PRAGMA {pragma} = {value}""")
+
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrows a read-only connection from the pool, opens a new one while the pool is not full,
+        waits for a returned one otherwise
+        :return: a context manager yielding the connection
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self._pool_size
+
+                if can_open:
+                    self._opened += 1
+
+            if can_open:
+                try:
+                    conn = self._connect(read_only=True)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+
+        try:
+            yield conn
+        finally:
+            # ends the read transaction, so the connection sees the latest commits next time
+            if conn.in_transaction:
+                conn.rollback()
+
+            self._pool.put(conn)
+
+    def writer(self) -> sqlite3.Connection:
+        """
+        :return: the dedicated connection for the ETL writes, opened on the first call
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+
+            return self._writer
+
+    def data_version(self) -> int:
+        """
+        Reads PRAGMA data_version on a dedicated read-only connection. The value is only meaningful on the same
+        connection, it changes whenever any other connection commits, so it tells the caches when to reload.
+        :return: the current data version
+        """
+        with self._probe_lock:
+            if self._probe is None:
+                self._probe = self._connect(read_only=True)
+
+            return self._probe.execute("""PRAGMA data_version""").fetchone()[0]
+
+    def close(self) -> None:
+        """Closes all the opened connections"""
+        with self._lock:
+            while True:
+                try:
+                    self._pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+            self._opened = 0
+
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._probe_lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+
+
+_manager = ConnectionManager()
+
+
+def configure(database: str = None, pool_size: int = READ_POOL_SIZE) -> ConnectionManager:
+    """
+    Points the process-wide connection manager to a given database, closes the connections to the previous one
+    :param database: path to the database
+    :param pool_size: maximum number of read-only connections
+    :return: the new connection manager
+    """
+    global _manager
+
+    _manager.close()
+    _manager = ConnectionManager(database=database, pool_size=pool_size)
+
+    return _manager
+
+
+def get_manager() -> ConnectionManager:
+    return _manager
+
+
+def read_connection():
+    """
+    Borrows a read-only connection from the pool of the process-wide connection manager
+    :return: a context manager yielding the connection
+    """
+    return _manager.reader()
+
+
+def get_data_version() -> int:
+    """
+    :return: the data version of the process-wide connection manager's database, see ConnectionManager.data_version
+    """
+    return _manager.data_version()
+
+
+def create_connection(db: str = None) -> sqlite3.Connection:
     """
-    Creates connection to sqlite database
-    :param db: path to db instance
+    Returns the dedicated writer connection to sqlite database
+    :param db: path to db instance, opens a separate tuned connection if given
     :return: a connection to the database
     """
-    conn = None
+    if db is not None:
+        return ConnectionManager(database=db)._connect(read_only=False)
 
-    try:
-        conn = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES)
-    except sqlite3.Error as e:
-        print(e)
+    return _manager.writer()
+
+
+def to_day_number(date) -> int:
+    """
+    Converts a date to the integer day number stored in the stocks table
+    :param date: date string, datetime or pd.Timestamp
+    :return: number of days since the unix epoch
+    """
+    return (pd.Timestamp(date).normalize() - EPOCH).days
+
+
+def to_day_numbers(dates) -> list[int]:
+    """
+    Vectorised version of to_day_number
+    :param dates: iterable of dates
+    :return: a list of day numbers
+    """
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype('int64').tolist()
+
+
+def from_day_numbers(days) -> pd.DatetimeIndex:
+    """
+    Converts the day numbers read from the stocks table back to dates
+    :param days: iterable of day numbers
+    :return: a DatetimeIndex
+    """
+    return pd.to_datetime(pd.Index(days, dtype='int64'), unit='D')
+
+
+def parse_price_columns(price_type: str) -> list[str]:
+    """
+    Splits and validates a comma separated list of price columns, since column names cannot be bound
+    :param price_type: price types, such as 'adj_close' or 'open, high, low, close'
+    :return: a list of column names
+    """
+    columns = [col.strip() for col in price_type.split(',')]
+    unknown = set(columns) - set(PRICE_COLUMNS)
+
+    if unknown:
+        raise ValueError(f'Unknown price columns: {", ".join(sorted(unknown))}')
+
+    return columns
+
+
+def load_symbol_filter(conn, symbols) -> None:
+    """
+    Fills the connection's temporary symbol_filter table with the given symbols.
+    The queries join against it instead of an IN list, so their text does not depend on the number of symbols
+    and the prepared statements are reused by the connection's statement cache.
+    :param conn: sqlite's connection to a database
+    :param symbols: iterable of symbols
+    :return: void function
+    """
+    conn.execute(
+        """
+            CREATE TEMP TABLE IF NOT EXISTS symbol_filter (
+                symbol VARCHAR(15) PRIMARY KEY
+            ) WITHOUT ROWID
+        """
+    )
+    conn.execute("""DELETE FROM temp.symbol_filter""")
+    conn.executemany("""INSERT OR IGNORE INTO temp.symbol_filter (symbol) VALUES (?)""", ((s,) for s in symbols))
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("""PRAGMA user_version""").fetchone()[0]
 
-    return conn
+
+def has_stocks_table(conn) -> bool:
+    return conn.execute(
+        """SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stocks'"""
+    ).fetchone() is not None
 
 
 def insert_stocks_into_db(row, conn, cursor) -> None:
@@ -54,13 +329,83 @@ def insert_stocks_into_db(row, conn, cursor) -> None:
         cursor.execute(
             """INSERT INTO stocks (date, symbol, open, high, low, close, adj_close, volume)
                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (row.Date.date(), row.Symbol, row.Open, row.High, row.Low, row.Close,
+            (to_day_number(row.Date), row.Symbol, row.Open, row.High, row.Low, row.Close,
              row['Adj Close'], row.Volume)
         )
     except conn.IntegrityError:
         pass
 
 
+def _stock_records(stocks_df: pd.DataFrame) -> list:
+    """
+        Converts a long stocks dataframe into a list of tuples ready to be bound to an insert statement
+        :param stocks_df: dataframe in the format returned by DataHandler.fetch_stocks_from_api
+        :return: list of (date, symbol, open, high, low, close, adj_close, volume) tuples
+    """
+    df = stocks_df[STOCK_COLUMNS]
+
+    # .tolist() converts numpy scalars to Python-native types, which sqlite3 can bind directly
+    columns = [to_day_numbers(df['Date'])] \
+        + [df[col].tolist() for col in STOCK_COLUMNS[1:]]
+
+    return list(zip(*columns))
+
+
+def insert_stocks_bulk(stocks_df: pd.DataFrame, conn, batch_size: int = BULK_BATCH_SIZE
+                       , upsert: bool = False) -> dict:
+    """
+        Inserts stocks data into database in batches, within a single transaction
+        :param stocks_df: dataframe in the format returned by DataHandler.fetch_stocks_from_api
+        :param conn: sqlite's connection to a database
+        :param batch_size: number of rows passed to a single executemany call
+        :param upsert: True if already stored rows should be overwritten with the new prices,
+            False if they should be left untouched
+        :return: a dictionary with the number of inserted, updated and skipped rows
+    """
+    records = _stock_records(stocks_df)
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    c = conn.cursor()
+
+    try:
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+
+            changes_before = conn.total_changes
+            c.executemany(
+                """INSERT OR IGNORE INTO stocks (date, symbol, open, high, low, close, adj_close, volume)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                batch
+            )
+            inserted = conn.total_changes - changes_before
+
+            updated = 0
+            if upsert and inserted < len(batch):
+                # only the rows whose values differ are touched, the freshly inserted ones are left as they are
+                changes_before = conn.total_changes
+                c.executemany(
+                    """UPDATE stocks
+                        SET open = :open, high = :high, low = :low, close = :close
+                            , adj_close = :adj_close, volume = :volume
+                        WHERE date = :date AND symbol = :symbol
+                        AND (open IS NOT :open OR high IS NOT :high OR low IS NOT :low OR close IS NOT :close
+                            OR adj_close IS NOT :adj_close OR volume IS NOT :volume)""",
+                    (dict(zip(['date', 'symbol', 'open', 'high', 'low', 'close', 'adj_close', 'volume'], row))
+                     for row in batch)
+                )
+                updated = conn.total_changes - changes_before
+
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+            counts['skipped'] += len(batch) - inserted - updated
+
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+    return counts
+
+
 def insert_info_into_db(row, conn, cursor) -> None:
     """
         Inserts info data into database in a given format
@@ -81,6 +426,93 @@ def insert_info_into_db(row, conn, cursor) -> None:
         pass
 
 
+def ensure_watermarks(conn) -> None:
+    """
+        Creates the watermarks table in databases initialised before it existed,
+        seeds it from the stocks table if it is empty
+        :param conn: sqlite's connection to a database
+        :return: void function
+    """
+    conn.execute(
+        """
+            CREATE TABLE IF NOT EXISTS watermarks (
+                symbol VARCHAR(15) PRIMARY KEY,
+                last_date DATETIME NOT NULL
+            )
+        """
+    )
+
+    if conn.execute("""SELECT 1 FROM watermarks LIMIT 1""").fetchone() is None:
+        conn.execute(
+            """
+                INSERT INTO watermarks (symbol, last_date)
+                SELECT symbol, date(MAX(date) * 86400, 'unixepoch')
+                FROM stocks
+                GROUP BY symbol
+            """
+        )
+
+    conn.commit()
+
+
+def get_watermarks(conn) -> dict:
+    """
+        Reads the last stored date of every symbol
+        :param conn: sqlite's connection to a database
+        :return: a dictionary of symbols mapped to their last stored date string
+    """
+    ensure_watermarks(conn)
+
+    return dict(conn.execute("""SELECT symbol, last_date FROM watermarks""").fetchall())
+
+
+def update_watermarks(stocks_df: pd.DataFrame, conn) -> None:
+    """
+        Moves the watermarks of the symbols contained in the freshly inserted data forward
+        :param stocks_df: dataframe in the format returned by DataHandler.fetch_stocks_from_api
+        :param conn: sqlite's connection to a database
+        :return: void function
+    """
+    if stocks_df.empty:
+        return
+
+    last_dates = pd.to_datetime(stocks_df['Date']).groupby(stocks_df['Symbol']).max().dt.strftime(DATE_FORMAT)
+
+    conn.executemany(
+        """
+            INSERT INTO watermarks (symbol, last_date)
+            VALUES (?, ?)
+            ON CONFLICT (symbol) DO UPDATE SET last_date = MAX(last_date, excluded.last_date)
+        """,
+        list(last_dates.items())
+    )
+
+    conn.commit()
+
+
+def ensure_checkpoints(conn) -> None:
+    """
+        Creates the backfill checkpoints table in databases initialised before it existed
+        :param conn: sqlite's connection to a database
+        :return: void function
+    """
+    conn.execute(
+        """
+            CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                chunk_id VARCHAR NOT NULL,
+                start_date DATETIME NOT NULL,
+                end_date DATETIME NOT NULL,
+                symbols VARCHAR NOT NULL,
+                row_count INTEGER DEFAULT 0,
+                completed_at DATETIME,
+                PRIMARY KEY (chunk_id, start_date, end_date)
+            )
+        """
+    )
+
+    conn.commit()
+
+
 def init_db() -> None:
     """Gets the database connection and runs an .sql database initialisation script"""
     db = get_db()
@@ -89,20 +521,47 @@ def init_db() -> None:
         db.executescript(f.read().decode('utf-8'))
 
 
-def populate_stocks(index: str = 'DAX') -> None:
-    """Populates the stocks table with the data from Yahoo! API"""
-    with create_connection() as conn:
-        c = conn.cursor()
-
-        data = dh.DataHandler(index=index, start_date=FIRST_DATE)
+def _ingest_stocks(stocks_df: pd.DataFrame, conn, bulk: bool = True, batch_size: int = BULK_BATCH_SIZE
+                   , upsert: bool = False) -> dict:
+    """
+        Writes the downloaded stocks data into the database, either in batches or row by row
+        :param stocks_df: dataframe in the format returned by DataHandler.fetch_stocks_from_api
+        :param conn: sqlite's connection to a database
+        :param bulk: True for the batched executemany path, False for the per-row path
+        :param batch_size: number of rows per batch, used only by the bulk path
+        :param upsert: overwrite already stored rows, used only by the bulk path
+        :return: a dictionary with the number of inserted, updated and skipped rows
+    """
+    ensure_watermarks(conn)
 
-        stocks_df = data.fetch_stocks_from_api()
+    if bulk:
+        counts = insert_stocks_bulk(stocks_df, conn=conn, batch_size=batch_size, upsert=upsert)
+    else:
+        c = conn.cursor()
+        changes_before = conn.total_changes
 
         for i, row in stocks_df.iterrows():
             insert_stocks_into_db(row=row, conn=conn, cursor=c)
 
         conn.commit()
 
+        inserted = conn.total_changes - changes_before
+        counts = {'inserted': inserted, 'updated': 0, 'skipped': len(stocks_df) - inserted}
+
+    update_watermarks(stocks_df, conn=conn)
+
+    return counts
+
+
+def populate_stocks(index: str = 'DAX', bulk: bool = True, batch_size: int = BULK_BATCH_SIZE) -> dict:
+    """Populates the stocks table with the data from Yahoo! API"""
+    with create_connection() as conn:
+        data = dh.DataHandler(index=index, start_date=FIRST_DATE)
+
+        stocks_df = data.fetch_stocks_from_api()
+
+        return _ingest_stocks(stocks_df, conn=conn, bulk=bulk, batch_size=batch_size)
+
 
 def populate_info(index: str = 'DAX') -> None:
     """Populates the info table with the data from Yahoo! API"""
@@ -120,31 +579,259 @@ def populate_info(index: str = 'DAX') -> None:
         conn.commit()
 
 
-def update_stocks(index: str = 'DAX') -> None:
-    """Gets the latest date from the stocks table, fills in the missing dates"""
+def update_stocks(index: str = 'DAX', bulk: bool = True, batch_size: int = BULK_BATCH_SIZE
+                  , upsert: bool = False) -> dict:
+    """
+    Downloads only the missing dates of every constituent, based on the per-symbol watermarks.
+    Symbols that are not in the database yet are backfilled from the FIRST_DATE,
+    symbols with the same missing range are downloaded together
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    tickers = dh.DataHandler(index=index).get_tickers()
+    today = datetime.today().strftime(DATE_FORMAT)
+
     with create_connection() as conn:
-        c = conn.cursor()
+        watermarks = get_watermarks(conn)
 
-        max_date = c.execute(
-            """
-                SELECT MAX(date)
-                FROM stocks
-            """
-        ).fetchone()[0]
+        missing_ranges = {}
+
+        for ticker in tickers:
+            if ticker in watermarks:
+                start_date = (datetime.strptime(watermarks[ticker], DATE_FORMAT) + timedelta(days=1)) \
+                    .strftime(DATE_FORMAT)
+            else:
+                start_date = FIRST_DATE
+
+            if start_date <= today:
+                missing_ranges.setdefault(start_date, set()).add(ticker)
 
-        if datetime.strptime(max_date, DATE_FORMAT) < datetime.today():
+        for start_date, symbols in sorted(missing_ranges.items()):
             data = dh.DataHandler(
-                index=index
-                , start_date=max_date
+                tickers=symbols
+                , start_date=start_date
             )
 
             stocks_df = data.fetch_stocks_from_api()
 
-            for i, row in stocks_df.iterrows():
-                insert_stocks_into_db(row=row, conn=conn, cursor=c)
+            group_counts = _ingest_stocks(stocks_df, conn=conn, bulk=bulk, batch_size=batch_size, upsert=upsert)
+
+            for key in counts:
+                counts[key] += group_counts[key]
+
+    return counts
+
+
+def migrate_db(conn) -> int:
+    """
+    Converts the stocks table of a database created with the first storage layout in place:
+    the table is clustered by (symbol, date) without a rowid, dates become day numbers,
+    prices become REAL and a secondary index supports the date range scans
+    Rows of a symbol falling on the same day, e.g. stored with different times, collapse into the latest one.
+    The whole conversion is one transaction, it is rolled back on an error and can be retried
+    :param conn: sqlite's connection to a database
+    :return: number of migrated rows, -1 if the database already uses the current layout
+    """
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return -1
+
+    if not has_stocks_table(conn):
+        raise sqlite3.OperationalError('The database has no stocks table, run "flask init-db" first.')
+
+    try:
+        _run_migration_script(conn)
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+    rows = conn.execute("""SELECT COUNT(*) FROM stocks""").fetchone()[0]
+
+    # rebuilds the file without the pages freed by the old table
+    conn.execute("""VACUUM""")
+
+    return rows
+
+
+def _run_migration_script(conn) -> None:
+    conn.executescript(
+        """
+            BEGIN;
+
+            -- left over by an earlier run that failed before it was rolled back
+            DROP TABLE IF EXISTS stocks_v2;
+
+            CREATE TABLE stocks_v2 (
+                symbol VARCHAR(15) NOT NULL,
+                date INTEGER NOT NULL,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                adj_close REAL,
+                volume INTEGER DEFAULT 0,
+                PRIMARY KEY (symbol, date),
+                FOREIGN KEY (symbol) REFERENCES companies(symbol)
+            ) WITHOUT ROWID;
+
+            -- julian day 2440587.5 is the unix epoch, only the latest row of a symbol's day is kept
+            INSERT INTO stocks_v2 (symbol, date, open, high, low, close, adj_close, volume)
+            SELECT symbol, day, open, high, low, close, adj_close, volume
+            FROM (
+                SELECT symbol, CAST(julianday(date) - 2440587.5 AS INTEGER) AS day
+                    , CAST(open AS REAL) AS open, CAST(high AS REAL) AS high, CAST(low AS REAL) AS low
+                    , CAST(close AS REAL) AS close, CAST(adj_close AS REAL) AS adj_close, volume
+                    , ROW_NUMBER() OVER (
+                        PARTITION BY symbol, CAST(julianday(date) - 2440587.5 AS INTEGER)
+                        ORDER BY julianday(date) DESC
+                    ) AS day_rank
+                FROM stocks
+            )
+            WHERE day_rank = 1
+            ORDER BY symbol, day;
+
+            DROP TABLE stocks;
+            ALTER TABLE stocks_v2 RENAME TO stocks;
+            CREATE INDEX stocks_date_idx ON stocks (date);
+
+            PRAGMA user_version = 2;
+
+            COMMIT;
+        """
+    )
+
+
+def _date_slices(start_date: str, end_date: str, slice_years: int) -> list[tuple[str, str]]:
+    """
+        Splits the date range into consecutive slices of a given number of years on a grid anchored at start_date,
+        the last slice ends on its grid boundary even past end_date, so the slices, and the checkpoints keyed by
+        them, stay the same whatever day the backfill runs on
+        :return: a list of (start, end) date strings, the end being exclusive
+    """
+    slices = []
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+    k = 0
+
+    while start < end:
+        k += 1
+        stop = pd.Timestamp(start_date) + pd.DateOffset(years=k * slice_years)
+        slices.append((start.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT)))
+        start = stop
+
+    return slices
 
+
+def _chunk_id(symbols: list[str]) -> str:
+    return hashlib.sha1(','.join(symbols).encode('utf-8')).hexdigest()[:16]
+
+
+def backfill_stocks(index: str = 'DAX', chunk_size: int = BACKFILL_CHUNK_SIZE
+                    , slice_years: int = BACKFILL_SLICE_YEARS, max_workers: int = BACKFILL_WORKERS
+                    , batch_size: int = BULK_BATCH_SIZE, start_date: str = FIRST_DATE
+                    , restart: bool = False, ticker_workers: int = BACKFILL_TICKER_WORKERS) -> tuple[dict, list]:
+    """
+    Backfills the stocks table in ticker chunks and date slices, downloaded concurrently.
+    Each chunk is written as soon as it arrives and recorded in the checkpoints table once all its tickers
+    were downloaded, so an interrupted run, or a run with failed tickers, continues with the chunks
+    that are still missing.
+    The last date slice is recorded once it was downloaded up to today, the days after that are added by update-db.
+    At most max_workers chunks are held in memory at once.
+    :param index: index whose constituents are backfilled
+    :param chunk_size: number of tickers per download
+    :param slice_years: number of years per download
+    :param max_workers: number of concurrent downloads
+    :param batch_size: number of rows per executemany batch
+    :param start_date: first date of the backfill
+    :param restart: forget the checkpoints of the previous runs and download everything again
+    :param ticker_workers: number of tickers downloaded concurrently within a chunk
+    :return: a tuple of the inserted/updated/skipped counts and a list of the (symbols, start, end) downloads
+        that failed, only the failed tickers of a chunk are listed
+    """
+    tickers = sorted(dh.DataHandler(index=index).get_tickers())
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+    # the end date is exclusive, tomorrow makes sure today's prices are included
+    end_date = (datetime.today() + timedelta(days=1)).strftime(DATE_FORMAT)
+
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    failed = []
+
+    def download(task):
+        _, symbols, slice_start, slice_end = task
+
+        # the slices follow a fixed grid, only the download of the last one stops at tomorrow
+        handler = dh.DataHandler(
+            tickers=set(symbols)
+            , start_date=slice_start
+            , end_date=min(slice_end, end_date)
+        )
+        stocks_df = handler.fetch_history_from_api(max_workers=ticker_workers)
+
+        return stocks_df, handler.get_history_failures()
+
+    with create_connection() as conn:
+        ensure_checkpoints(conn)
+
+        if restart:
+            conn.execute("""DELETE FROM backfill_checkpoints""")
             conn.commit()
 
+        done = set(conn.execute("""SELECT chunk_id, start_date, end_date FROM backfill_checkpoints""").fetchall())
+
+        tasks = iter([
+            (_chunk_id(symbols), symbols, slice_start, slice_end)
+            for symbols in chunks
+            for slice_start, slice_end in _date_slices(start_date, end_date, slice_years)
+            if (_chunk_id(symbols), slice_start, slice_end) not in done
+        ])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # only max_workers downloads are in flight, the next one is submitted once a chunk is written
+            pending = {executor.submit(download, task): task for task in itertools.islice(tasks, max_workers)}
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    chunk_id, symbols, slice_start, slice_end = pending.pop(future)
+
+                    try:
+                        stocks_df, failures = future.result()
+                    except Exception as e:
+                        print(f'Chunk {symbols[0]}..{symbols[-1]} {slice_start} - {slice_end} failed: {e}')
+                        failed.append((symbols, slice_start, slice_end))
+                    else:
+                        # the downloaded tickers are kept, the rerun skips their rows
+                        chunk_counts = _ingest_stocks(stocks_df, conn=conn, batch_size=batch_size)
+
+                        for key in counts:
+                            counts[key] += chunk_counts[key]
+
+                        if failures:
+                            print(f'Chunk {symbols[0]}..{symbols[-1]} {slice_start} - {slice_end}: '
+                                  f'{len(failures)} tickers failed: {", ".join(sorted(failures))}')
+                            failed.append((sorted(failures), slice_start, slice_end))
+                        else:
+                            conn.execute(
+                                """
+                                    INSERT OR REPLACE INTO backfill_checkpoints
+                                    (chunk_id, start_date, end_date, symbols, row_count, completed_at)
+                                    VALUES (?, ?, ?, ?, ?, ?)
+                                """,
+                                (chunk_id, slice_start, slice_end, ','.join(symbols), len(stocks_df)
+                                 , datetime.now().isoformat(timespec='seconds'))
+                            )
+                            conn.commit()
+
+                            print(f'Chunk {symbols[0]}..{symbols[-1]} {slice_start} - {slice_end}: '
+                                  f'{len(stocks_df)} rows')
+
+                    next_task = next(tasks, None)
+
+                    if next_task is not None:
+                        pending[executor.submit(download, next_task)] = next_task
+
+    return counts, failed
+
 
 def update_info(index: str = 'DAX') -> None:
     """Gets missing companies' data from the API and inserts it into the database"""
@@ -176,36 +863,154 @@ def update_info(index: str = 'DAX') -> None:
             conn.commit()
 
 
+def _format_counts(counts: dict) -> str:
+    return ', '.join(f'{value} {key}' for key, value in counts.items())
+
+
+def _refresh_snapshot() -> None:
+    rows = st.refresh_snapshot()
+
+    if rows < 0:
+        click.echo('pyarrow is not installed, the columnar snapshot was not refreshed.')
+    else:
+        click.echo(f'The columnar snapshot was refreshed with {rows} rows.')
+
+
+def _update_online_pca() -> None:
+    path = pe.get_online_pca_path()
+
+    if not os.path.exists(path):
+        click.echo('There is no online PCA model, build it with "flask init-online-pca".')
+        return
+
+    model = pe.OnlinePCA.load(path)
+    days = model.update_from_db()
+    model.save(path)
+
+    click.echo(f'The online PCA model absorbed {days} trading days, it ends on {model.last_date:{DATE_FORMAT}}.')
+
+
+def _check_schema_version() -> None:
+    conn = create_connection()
+
+    if not has_stocks_table(conn):
+        raise click.ClickException('The database is not initialised, run "flask init-db" first.')
+
+    if get_schema_version(conn) < SCHEMA_VERSION:
+        raise click.ClickException('The database uses an outdated storage layout, run "flask migrate-db" first.')
+
+
 # CLI commands initiation
 @click.command('init-db')
 def init_db_command():
     init_db()
+    st.ParquetStorage().clear()
+
+    if os.path.exists(pe.get_online_pca_path()):
+        os.remove(pe.get_online_pca_path())
+
     click.echo('Initialisation complete.')
 
 
 @click.command('populate-db')
 @click.argument('index')
-def populate_db_command(index):
+@click.option('--batch-size', default=BULK_BATCH_SIZE, show_default=True, help='Rows per executemany batch.')
+@click.option('--per-row', is_flag=True, help='Insert the rows one by one instead of in batches.')
+def populate_db_command(index, batch_size, per_row):
+    _check_schema_version()
     click.echo(f'Choose index {index}')
     populate_info(index=index)
     click.echo(f'Finish populating reference table for index {index}')
-    populate_stocks(index=index)
+    counts = populate_stocks(index=index, bulk=not per_row, batch_size=batch_size)
+    click.echo(f'Stocks rows: {_format_counts(counts)}')
     click.echo('The tables were populated successfully.')
+    _refresh_snapshot()
 
 
 @click.command('update-db')
 @click.argument('index')
-def update_db_command(index):
+@click.option('--batch-size', default=BULK_BATCH_SIZE, show_default=True, help='Rows per executemany batch.')
+@click.option('--per-row', is_flag=True, help='Insert the rows one by one instead of in batches.')
+@click.option('--upsert', is_flag=True, help='Overwrite already stored rows with the freshly downloaded prices.')
+def update_db_command(index, batch_size, per_row, upsert):
+    _check_schema_version()
     click.echo(f'Choose index {index}')
     update_info(index=index)
     click.echo(f'Finish updating reference table.')
-    update_stocks(index=index)
+    counts = update_stocks(index=index, bulk=not per_row, batch_size=batch_size, upsert=upsert)
+    click.echo(f'Stocks rows: {_format_counts(counts)}')
     click.echo('The database was updated successfully.')
+    _update_online_pca()
+    _refresh_snapshot()
+
+
+@click.command('backfill-db')
+@click.argument('index')
+@click.option('--chunk-size', default=BACKFILL_CHUNK_SIZE, show_default=True, help='Tickers per download.')
+@click.option('--slice-years', default=BACKFILL_SLICE_YEARS, show_default=True, help='Years per download.')
+@click.option('--workers', default=BACKFILL_WORKERS, show_default=True, help='Concurrent downloads.')
+@click.option('--ticker-workers', default=BACKFILL_TICKER_WORKERS, show_default=True
+              , help='Concurrent tickers within each download.')
+@click.option('--batch-size', default=BULK_BATCH_SIZE, show_default=True, help='Rows per executemany batch.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoints of previous runs.')
+def backfill_db_command(index, chunk_size, slice_years, workers, ticker_workers, batch_size, restart):
+    _check_schema_version()
+    click.echo(f'Choose index {index}')
+    counts, failed = backfill_stocks(
+        index=index
+        , chunk_size=chunk_size
+        , slice_years=slice_years
+        , max_workers=workers
+        , batch_size=batch_size
+        , restart=restart
+        , ticker_workers=ticker_workers
+    )
+    click.echo(f'Stocks rows: {_format_counts(counts)}')
+
+    if failed:
+        click.echo(f'{len(failed)} downloads failed, run the command again to retry them.')
+    else:
+        click.echo('The backfill finished successfully.')
+
+    _refresh_snapshot()
+
+
+@click.command('migrate-db')
+def migrate_db_command():
+    conn = create_connection()
+
+    if not has_stocks_table(conn):
+        raise click.ClickException('The database is not initialised, run "flask init-db" first.')
+
+    rows = migrate_db(conn)
+
+    if rows < 0:
+        click.echo('The database already uses the current storage layout.')
+    else:
+        click.echo(f'Migrated {rows} rows to the storage layout v{SCHEMA_VERSION}.')
+
+
+@click.command('refresh-snapshot')
+def refresh_snapshot_command():
+    _refresh_snapshot()
+
+
+@click.command('init-online-pca')
+@click.option('--halflife', type=float, help='Days after which a day\'s weight halves, equal weights if not given.')
+def init_online_pca_command(halflife):
+    model = pe.OnlinePCA.from_db(halflife=halflife)
+    model.save()
+    click.echo(f'The online PCA model was built from {model.count} trading days of {len(model.symbols)} stocks.')
 
 
 def init_app(app):
+    configure(database=app.config['DATABASE'])
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
     app.cli.add_command(populate_db_command)
     app.cli.add_command(update_db_command)
+    app.cli.add_command(backfill_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(refresh_snapshot_command)
+    app.cli.add_command(init_online_pca_command)
 
@@ -0,0 +1,368 @@
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+import pandas as pd
+from pca_dax import data_handler as dh
+from pca_dax import pca_engines as pe
+
+
+# number of column layouts whose alignment to the loadings a projector remembers
+ALIGNMENT_CACHE_SIZE = 32
+
+# share of a component's squared loadings that has to be observed on a day, the score is NaN below it
+MIN_COVERAGE = 0.5
+
+# symbols: the regressed stocks, factors: the factors' names
+# alphas: intercepts, betas: exposures to the factors, the last axis being the factors
+# r_squared: share of the variance explained by the factors
+# residual_vol: standard deviation of the residuals, with the degrees of freedom of the regression
+# specific_variance: the residual variances, the diagonal of the specific risk matrix
+# dates: last day of every window, None for a regression over the whole sample
+FactorRegression = namedtuple(
+    'FactorRegression'
+    , ['symbols', 'factors', 'alphas', 'betas', 'r_squared', 'residual_vol', 'specific_variance', 'dates']
+)
+
+# variance, volatility: total risk of every portfolio
+# factor_variance: portfolios x factors variance attributed to every factor, sums to the systematic variance
+# specific_variance: variance of every portfolio not explained by the factors
+# marginal: portfolios x stocks derivatives of the volatility by the weights
+# contributions: portfolios x stocks weights times the marginal contributions, sums to the volatility
+PortfolioRisk = namedtuple(
+    'PortfolioRisk'
+    , ['variance', 'volatility', 'factor_variance', 'specific_variance', 'marginal', 'contributions']
+)
+
+
+def _check_inputs(returns: pd.DataFrame, factors: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    if not returns.index.equals(factors.index):
+        raise ValueError('The returns and the factors should share the same dates')
+
+    y = returns.to_numpy(dtype=np.float64)
+    f = factors.to_numpy(dtype=np.float64)
+
+    if np.isnan(y).any() or np.isnan(f).any():
+        raise ValueError('The returns and the factors should not contain missing values')
+
+    if len(y) <= f.shape[1] + 1:
+        raise ValueError('The regression needs more days than factors plus one')
+
+    return y, f
+
+
+def _statistics(ff: np.ndarray, fy: np.ndarray, yy: np.ndarray, y_sum: np.ndarray, n_days: int) -> tuple:
+    """
+    Solves the normal equations of all the stocks at once from the cross-products of the design matrix [1, F]
+    and the returns Y: ff = [1, F].T @ [1, F], fy = [1, F].T @ Y, yy = the squared sums of the columns of Y
+    :return: a tuple of the alphas, the betas, R^2, the residual vol and the specific variances
+    """
+    coef = np.linalg.solve(ff, fy)
+
+    # at the least squares solution the residual sum of squares is y'y - b'F'y
+    ss_res = np.clip(yy - np.einsum('ij,ij->j', coef, fy), 0, None)
+    ss_tot = yy - np.square(y_sum) / n_days
+    specific_variance = ss_res / (n_days - ff.shape[0])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+
+    return coef[0], coef[1:].T, r_squared, np.sqrt(specific_variance), specific_variance
+
+
+def regress_on_factors(returns: pd.DataFrame, factors: pd.DataFrame) -> FactorRegression:
+    """
+    Regresses the returns of every stock on the factors with an intercept, all the stocks in one least squares solve
+    :param returns: days x stocks returns, e.g. DataHandler.create_daily_change
+    :param factors: days x factors returns, e.g. PCA.transform
+    :return: a FactorRegression, with stocks x factors betas
+    """
+    y, f = _check_inputs(returns, factors)
+    design = np.column_stack([np.ones(len(f)), f])
+
+    coef, ss_res, _, _ = np.linalg.lstsq(design, y, rcond=None)
+
+    # lstsq does not report the residuals of a rank deficient design
+    if len(ss_res) == 0:
+        ss_res = np.square(y - design @ coef).sum(axis=0)
+
+    ss_tot = np.square(y - y.mean(axis=0)).sum(axis=0)
+    specific_variance = ss_res / (len(y) - design.shape[1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+
+    return FactorRegression(
+        symbols=returns.columns
+        , factors=factors.columns
+        , alphas=coef[0]
+        , betas=coef[1:].T
+        , r_squared=r_squared
+        , residual_vol=np.sqrt(specific_variance)
+        , specific_variance=specific_variance
+        , dates=None
+    )
+
+
+def rolling_regress_on_factors(returns: pd.DataFrame, factors: pd.DataFrame, window: int = 252
+                               , step: int = 21) -> FactorRegression:
+    """
+    Regresses the returns on the factors over a sliding window. The cross-products of the design matrix and the returns
+    are updated with the entering and the leaving days, so a slide costs O(step * k * N) plus a k x k solve.
+    :param returns: days x stocks returns
+    :param factors: days x factors returns
+    :param window: number of days in a window
+    :param step: number of days the window slides by
+    :return: a FactorRegression with a leading windows axis on every array
+    """
+    y, f = _check_inputs(returns, factors)
+
+    if not f.shape[1] + 1 < window <= len(y):
+        raise ValueError(f'The window should be longer than the number of factors plus one and at most {len(y)} days')
+
+    design = np.column_stack([np.ones(len(f)), f])
+    window_ends = np.arange(window, len(y) + 1, step)
+    stats = []
+    ff = fy = yy = y_sum = None
+
+    for i, end in enumerate(window_ends):
+        start = end - window
+
+        if i == 0 or step >= window or i % pe.ROLLING_REFRESH_EVERY == 0:
+            ff = design[start:end].T @ design[start:end]
+            fy = design[start:end].T @ y[start:end]
+            yy = np.square(y[start:end]).sum(axis=0)
+            y_sum = y[start:end].sum(axis=0)
+        else:
+            entering, leaving = slice(end - step, end), slice(start - step, start)
+
+            ff += design[entering].T @ design[entering] - design[leaving].T @ design[leaving]
+            fy += design[entering].T @ y[entering] - design[leaving].T @ y[leaving]
+            yy += np.square(y[entering]).sum(axis=0) - np.square(y[leaving]).sum(axis=0)
+            y_sum += y[entering].sum(axis=0) - y[leaving].sum(axis=0)
+
+        stats.append(_statistics(ff, fy, yy, y_sum, window))
+
+    alphas, betas, r_squared, residual_vol, specific_variance = (np.stack(arrays) for arrays in zip(*stats))
+
+    return FactorRegression(
+        symbols=returns.columns
+        , factors=factors.columns
+        , alphas=alphas
+        , betas=betas
+        , r_squared=r_squared
+        , residual_vol=residual_vol
+        , specific_variance=specific_variance
+        , dates=returns.index[window_ends - 1]
+    )
+
+
+def regression_to_frame(regression: FactorRegression) -> pd.DataFrame:
+    """
+    :param regression: a regression over the whole sample
+    :return: a dataframe with a row per symbol: alpha, the betas, R^2, the residual vol, the specific variance
+        and the idiosyncratic share of the variance, i.e. 1 - R^2
+    """
+    if regression.dates is not None:
+        raise ValueError('Only a regression over the whole sample can be turned into a dataframe')
+
+    frame = pd.DataFrame(
+        regression.betas
+        , index=regression.symbols
+        , columns=[f'beta_{factor}' for factor in regression.factors]
+    )
+
+    frame.insert(0, 'alpha', regression.alphas)
+    frame['r_squared'] = regression.r_squared
+    frame['residual_vol'] = regression.residual_vol
+    frame['specific_variance'] = regression.specific_variance
+    frame['idio_share'] = 1 - regression.r_squared
+
+    return frame
+
+
+class FactorRiskModel:
+    """
+    Covariance model of the stocks' returns as B diag(f) B.T + diag(d), with N x k exposures B, k factor variances f
+    and N specific variances d. The risk of a portfolio is evaluated through its k factor exposures,
+    so a batch of P portfolios costs O(P * N * k) instead of the O(P * N^2) of the full covariance matrix.
+    """
+    def __init__(self, exposures: pd.DataFrame, factor_variances: np.ndarray, specific_variances: np.ndarray):
+        """
+        :param exposures: stocks x factors exposures, the symbols as the index
+        :param factor_variances: variances of the uncorrelated factors
+        :param specific_variances: specific variances of the stocks
+        """
+        self._symbols = exposures.index
+        self._factors = exposures.columns
+        self._exposures = exposures.to_numpy(dtype=np.float64)
+        self._factor_variances = np.asarray(factor_variances, dtype=np.float64)
+        self._specific_variances = np.asarray(specific_variances, dtype=np.float64)
+
+    @classmethod
+    def from_pca(cls, result: 'dh.PCAResult', returns: pd.DataFrame):
+        """
+        Builds the model from a fitted PCA, the retained components are the factors
+        and the variance they leave unexplained is the specific variance.
+        The loadings of a correlation based PCA are scaled by the stocks' volatilities.
+        :param result: the fitted result
+        :param returns: the returns the result was fitted on, for their variances
+        :return: the model
+        """
+        variances = returns[result.loadings.index].var().to_numpy()
+        eigenvalues = result.eigenvalues[:result.n_comp]
+
+        if result.cov_base:
+            exposures = result.loadings
+        else:
+            exposures = result.loadings.mul(np.sqrt(variances), axis=0)
+
+        systematic = np.square(exposures.to_numpy()) @ eigenvalues
+
+        return cls(exposures, eigenvalues, np.clip(variances - systematic, 0, None))
+
+    @property
+    def symbols(self) -> pd.Index:
+        return self._symbols
+
+    def covariance(self) -> np.ndarray:
+        """
+        :return: the dense N x N covariance matrix of the model, for comparisons
+        """
+        return (self._exposures * self._factor_variances) @ self._exposures.T + np.diag(self._specific_variances)
+
+    def _weights(self, weights) -> np.ndarray:
+        if isinstance(weights, pd.DataFrame):
+            weights = weights.reindex(columns=self._symbols, fill_value=0)
+        elif isinstance(weights, pd.Series):
+            weights = weights.reindex(self._symbols, fill_value=0)
+
+        return np.atleast_2d(np.asarray(weights, dtype=np.float64))
+
+    def portfolio_risk(self, weights, marginal: bool = True) -> PortfolioRisk:
+        """
+        Evaluates a batch of portfolios
+        :param weights: portfolios x stocks weights in the order of the model's symbols, or a dataframe
+            with symbols as the columns (a series for one portfolio), the missing symbols get a zero weight
+        :param marginal: compute the portfolios x stocks marginal contributions, writing them dominates the cost
+            of a large batch, the variances and the factor attribution alone only take the O(N * k) exposures
+        :return: a PortfolioRisk, with a leading portfolios axis on every array,
+            the marginal contributions and the contributions are None if not computed
+        """
+        w = self._weights(weights)
+
+        portfolio_exposures = w @ self._exposures
+        factor_variance = np.square(portfolio_exposures) * self._factor_variances
+        specific_variance = np.einsum('pi,pi,i->p', w, w, self._specific_variances)
+        variance = factor_variance.sum(axis=1) + specific_variance
+        volatility = np.sqrt(variance)
+
+        if not marginal:
+            return PortfolioRisk(
+                variance=variance
+                , volatility=volatility
+                , factor_variance=factor_variance
+                , specific_variance=specific_variance
+                , marginal=None
+                , contributions=None
+            )
+
+        # the covariance times the weights, B (f * B.T w) + d * w, without ever forming the covariance
+        marginals = (portfolio_exposures * self._factor_variances) @ self._exposures.T
+        marginals += w * self._specific_variances
+
+        # a portfolio without any risk gets zero marginal contributions
+        inv_volatility = np.zeros_like(volatility)
+        np.divide(1, volatility, out=inv_volatility, where=volatility > 0)
+        marginals *= inv_volatility[:, None]
+
+        return PortfolioRisk(
+            variance=variance
+            , volatility=volatility
+            , factor_variance=factor_variance
+            , specific_variance=specific_variance
+            , marginal=marginals
+            , contributions=w * marginals
+        )
+
+
+class FactorProjector:
+    """
+    Projects returns onto the loadings of a fitted PCAResult, out of sample and in batches.
+    The returns' columns are mapped onto the loadings' rows once per column layout, a batch then costs two matmuls.
+    A day with missing symbols is not dropped: its score is the least squares fit of the observed stocks only,
+    (X filled with 0) @ L divided by mask @ L^2, which equals X @ L when all the stocks are observed.
+    """
+    def __init__(self, result: 'dh.PCAResult', min_coverage: float = MIN_COVERAGE):
+        """
+        :param result: the fitted result whose loadings the returns are projected onto
+        :param min_coverage: share of a component's squared loadings that has to be observed on a day,
+            the day's score of the component is NaN below it
+        """
+        self._result = result
+        self._loadings = result.loadings.to_numpy()
+        self._squared_loadings = np.square(self._loadings)
+        self._components = result.loadings.columns
+        self._symbols = result.loadings.index
+        self._min_coverage = min_coverage
+        self._alignments = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def result(self) -> 'dh.PCAResult':
+        return self._result
+
+    def _align(self, columns: pd.Index) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: positions of the columns that have a loading and the loadings' rows they map to
+        """
+        key = tuple(columns)
+
+        with self._lock:
+            if key in self._alignments:
+                self._alignments.move_to_end(key)
+
+                return self._alignments[key]
+
+        rows = self._symbols.get_indexer(columns)
+        known = np.flatnonzero(rows >= 0)
+        alignment = (known, rows[known])
+
+        with self._lock:
+            self._alignments[key] = alignment
+
+            while len(self._alignments) > ALIGNMENT_CACHE_SIZE:
+                self._alignments.popitem(last=False)
+
+        return alignment
+
+    def transform(self, returns: pd.DataFrame) -> pd.DataFrame:
+        """
+        Projects one batch of returns, the symbols without a loading are ignored,
+        the symbols with a loading but without a column are treated as missing
+        :param returns: days x symbols returns, NaN where missing, the columns can be any subset and order of symbols
+        :return: days x components factor scores
+        """
+        columns, rows = self._align(returns.columns)
+
+        # a loaded symbol absent from the batch is missing on every day, not a zero return
+        x = np.full((len(returns), len(self._symbols)), np.nan)
+        x[:, rows] = returns.to_numpy(dtype=np.float64)[:, columns]
+
+        observed = ~np.isnan(x)
+        x[~observed] = 0
+
+        numerator = x @ self._loadings
+        denominator = observed.astype(np.float64) @ self._squared_loadings
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(denominator >= self._min_coverage, numerator / denominator, np.nan)
+
+        return pd.DataFrame(scores, index=returns.index, columns=self._components)
+
+    def transform_many(self, batches) -> list[pd.DataFrame]:
+        """
+        Projects any number of batches, e.g. new days, other universes or intraday snapshots
+        :param batches: iterable of days x symbols returns
+        :return: list of days x components factor scores in the order of the batches
+        """
+        return [self.transform(returns) for returns in batches]
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import requests
+from flask import current_app, has_app_context
+
+
+DEFAULT_CACHE_DIR = os.path.join('instance', 'http_cache')
+
+# number of seconds a cached response is used without asking the server whether it changed
+DEFAULT_TTL = 24 * 60 * 60
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36')
+
+
+class HttpCache:
+    """
+    Directory-backed cache of HTTP responses keyed by URL and query parameters.
+    A cached response is used as is until its TTL runs out, then it is revalidated with its ETag/Last-Modified,
+    so an unchanged resource costs a 304 instead of a download. The parsed form of a response is cached as well
+    and reused until the response body changes.
+    In offline mode the network is never touched, which lets a directory of recorded responses serve as a fixture.
+    :param directory: cache directory, resolved from the app's HTTP_CACHE_DIR config if not given
+    :param ttl: default number of seconds a response stays fresh
+    :param offline: serve only what is in the cache, raise if a response is missing
+    """
+    def __init__(self, directory: str = None, ttl: float = DEFAULT_TTL, offline: bool = None):
+        self._directory = directory
+        self._ttl = ttl
+        self._offline = offline if offline is not None else os.environ.get('PCA_HTTP_CACHE_OFFLINE') == '1'
+
+    def get_directory(self) -> str:
+        """
+        :return: the configured cache directory, falls back to the app's HTTP_CACHE_DIR config,
+            the PCA_HTTP_CACHE_DIR environment variable and the default instance path in this order
+        """
+        if self._directory is not None:
+            return self._directory
+
+        if has_app_context() and current_app.config.get('HTTP_CACHE_DIR'):
+            return current_app.config['HTTP_CACHE_DIR']
+
+        return os.environ.get('PCA_HTTP_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+    @staticmethod
+    def get_key(url: str, params: dict = None) -> str:
+        query = json.dumps(sorted((params or {}).items()), default=str)
+
+        return hashlib.sha256(f'{url}?{query}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.get_directory(), f'{key}.{suffix}')
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # writes to a temporary file first, so a reader never sees a half written file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+        os.replace(tmp_path, path)
+
+    def _read_meta(self, key: str):
+        try:
+            with open(self._path(key, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        self._write(self._path(key, 'json'), json.dumps(meta, indent=2).encode('utf-8'))
+
+    def _revalidate(self, key: str, url: str, params: dict, headers: dict, meta, limiter) -> None:
+        request_headers = {'User-Agent': USER_AGENT, **(headers or {})}
+
+        if meta is not None:
+            if meta.get('etag'):
+                request_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                request_headers['If-Modified-Since'] = meta['last_modified']
+
+        if limiter is not None:
+            limiter.acquire()
+
+        response = requests.get(url, params=params, headers=request_headers, timeout=30)
+
+        if response.status_code == 304 and meta is not None:
+            meta['fetched_at'] = time.time()
+            self._write_meta(key, meta)
+            return
+
+        response.raise_for_status()
+
+        os.makedirs(self.get_directory(), exist_ok=True)
+        self._write(self._path(key, 'body'), response.content)
+
+        body_hash = hashlib.sha256(response.content).hexdigest()
+
+        self._write_meta(key, {
+            'url': url
+            , 'params': params
+            , 'etag': response.headers.get('ETag')
+            , 'last_modified': response.headers.get('Last-Modified')
+            , 'fetched_at': time.time()
+            , 'body_hash': body_hash
+        })
+
+    def get(self, url: str, params: dict = None, headers: dict = None, parse=None, ttl: float = None
+            , limiter=None):
+        """
+        Returns the response body of a GET request, from the cache when it is fresh or unchanged
+        :param url: requested URL
+        :param params: query parameters, part of the cache key
+        :param headers: additional request headers
+        :param parse: function turning the body bytes into the returned object, its result is cached too
+        :param ttl: number of seconds the response stays fresh, the cache's default if not given
+        :param limiter: object with an acquire() method called before every actual request
+        :return: the body bytes, or the parsed object if parse is given
+        """
+        key = self.get_key(url, params)
+        meta = self._read_meta(key)
+        ttl = self._ttl if ttl is None else ttl
+
+        if self._offline:
+            if meta is None:
+                raise FileNotFoundError(f'No cached response for {url} in {self.get_directory()}')
+        elif meta is None or time.time() - meta['fetched_at'] >= ttl:
+            try:
+                self._revalidate(key, url, params, headers, meta, limiter)
+            except requests.RequestException:
+                # a stale response is better than none when the server cannot be reached
+                if meta is None:
+                    raise
+
+            meta = self._read_meta(key)
+
+        if parse is None:
+            with open(self._path(key, 'body'), 'rb') as f:
+                return f.read()
+
+        parsed_path = self._path(key, f'{parse.__module__}.{parse.__qualname__}.pkl')
+
+        try:
+            with open(parsed_path, 'rb') as f:
+                body_hash, parsed = pickle.load(f)
+
+            if body_hash == meta['body_hash']:
+                return parsed
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+
+        with open(self._path(key, 'body'), 'rb') as f:
+            parsed = parse(f.read())
+
+        self._write(parsed_path, pickle.dumps((meta['body_hash'], parsed)))
+
+        return parsed
+
+
+_cache = HttpCache()
+
+
+def configure(directory: str = None, ttl: float = DEFAULT_TTL, offline: bool = None) -> HttpCache:
+    """
+    Replaces the process-wide HTTP cache, e.g. with an offline one reading recorded fixtures
+    :param directory: cache directory
+    :param ttl: default number of seconds a response stays fresh
+    :param offline: serve only what is in the cache
+    :return: the new cache
+    """
+    global _cache
+
+    _cache = HttpCache(directory=directory, ttl=ttl, offline=offline)
+
+    return _cache
+
+
+def get_cache() -> HttpCache:
+    return _cache
@@ -0,0 +1,330 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from pca_dax import data_handler as dh
+from pca_dax.common import FIRST_DATE
+
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close']
+SECTOR_INDEX_BASE = 100.
+
+SectorCube = namedtuple('SectorCube', ['mean_price', 'equal_weighted', 'cap_weighted'])
+
+
+def sector_cube(prices: pd.DataFrame, info: pd.DataFrame, base: float = SECTOR_INDEX_BASE) -> SectorCube:
+    """
+    Aggregates the stocks' prices by sector into date x sector matrices, each one a single product
+    of the day x stock matrix with the stock x sector membership matrix.
+    The return indices compound the mean daily return of the sector's stocks priced on both days,
+    the cap-weighted one weights them by the current market cap from the companies' info,
+    a stock without a market cap is left out of it and a sector without any is NaN on every day
+    :param prices: date x symbol prices, NaN where a price is missing
+    :param info: the companies' info with the symbol, the sector and the market_cap columns
+    :param base: the indices' value before the first return
+    :return: the sectors' mean price, equal-weighted and cap-weighted return indices
+    """
+    info = info.dropna(subset=['sector']).drop_duplicates('symbol').set_index('symbol')
+    symbols = prices.columns.intersection(info.index)
+    codes, sectors = pd.factorize(info.loc[symbols, 'sector'], sort=True)
+
+    membership = np.zeros((len(symbols), len(sectors)))
+    membership[np.arange(len(symbols)), codes] = 1.
+
+    def weighted_mean(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        present = ~np.isnan(values)
+        total = np.where(present, values, 0.) @ (membership * weights[:, None])
+        count = present @ (membership * weights[:, None])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def return_index(returns: np.ndarray) -> np.ndarray:
+        returns = np.nan_to_num(returns, nan=0.)
+        returns[0] = 0.
+
+        return base * np.cumprod(1. + returns, axis=0)
+
+    matrix = prices[symbols].to_numpy(dtype=np.float64)
+    returns = np.full_like(matrix, np.nan)
+    returns[1:] = matrix[1:] / matrix[:-1] - 1.
+
+    market_cap = pd.to_numeric(info.loc[symbols, 'market_cap'], errors='coerce').fillna(0.).to_numpy()
+
+    def to_frame(values: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(values, index=prices.index, columns=pd.Index(sectors, name='sector'))
+
+    cap_weighted = return_index(weighted_mean(returns, market_cap))
+    # a flat line at the base would look like data
+    cap_weighted[:, market_cap @ membership == 0] = np.nan
+
+    return SectorCube(
+        mean_price=to_frame(weighted_mean(matrix, np.ones(len(symbols))))
+        , equal_weighted=to_frame(return_index(weighted_mean(returns, np.ones(len(symbols)))))
+        , cap_weighted=to_frame(cap_weighted)
+    )
+
+
+class SymbolPartitions:
+    """
+    The stocks' history partitioned by symbol: one sort puts every symbol's days next to each other
+    in date order, so a symbol is a contiguous block found in O(1) and a date range within it
+    is a binary search instead of a mask over every row of every stock.
+    :param history: the long frame of the stocks' prices with a symbol column, indexed by date
+    """
+    def __init__(self, history: pd.DataFrame):
+        codes, symbols = pd.factorize(history['symbol'], sort=True)
+        order = np.lexsort((history.index.to_numpy(), codes))
+        bounds = np.searchsorted(codes[order], np.arange(len(symbols) + 1))
+
+        self._dates = history.index.to_numpy()[order]
+        self._prices = {column: history[column].to_numpy()[order] for column in PRICE_COLUMNS}
+        self._partitions = {
+            symbol: (bounds[i], bounds[i + 1])
+            for i, symbol in enumerate(symbols)
+        }
+
+    @property
+    def symbols(self) -> list[str]:
+        return list(self._partitions)
+
+    def _bounds(self, symbol: str, start_date: str = None, end_date: str = None) -> tuple[int, int]:
+        """
+        :return: the positions of the symbol's days strictly between the dates, the open ends are unbounded
+        """
+        offset, stop = self._partitions.get(symbol, (0, 0))
+        dates = self._dates[offset:stop]
+        first, last = 0, len(dates)
+
+        if start_date is not None:
+            first = np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date)), side='right')
+        if end_date is not None:
+            last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end_date)), side='left')
+
+        return offset + first, offset + max(first, last)
+
+    def get(
+            self
+            , symbol: str
+            , start_date: str = None
+            , end_date: str = None
+            , columns: list[str] = None
+    ) -> pd.DataFrame:
+        """
+        :param symbol: stock's symbol, an unknown one gives an empty frame
+        :param start_date: the days after this date are returned, from the first day if not given
+        :param end_date: the days before this date are returned, up to the last day if not given
+        :param columns: price types to return, all of them if not given
+        :return: the symbol's prices, indexed by date. The arrays are views of the partitions, so they must not be modified
+        """
+        first, last = self._bounds(symbol, start_date, end_date)
+
+        return pd.DataFrame(
+            {column: self._prices[column][first:last] for column in (columns or PRICE_COLUMNS)}
+            , index=pd.DatetimeIndex(self._dates[first:last], name='date')
+            , copy=False
+        )
+
+
+class MarketDataStore:
+    """
+    Process-wide store of the market data shown by the Dash apps: the raw price matrix, the stocks' history,
+    the companies' info and the series derived from them. Everything is loaded on first use and then shared,
+    a narrower window, such as the PCA app's one, is a slice of the full price matrix preprocessed on its own
+    instead of a new query. The returned frames are shared by all the callers, so they must not be modified.
+    The store is dropped once the storage reports a new data version, so the apps pick up an update-db run.
+    The store owns the invalidation of everything the apps show, it does not rely on DataHandler's own cache.
+    :param start_date: first date of the full window
+    :param storage: the backend the data are read from, chosen by DataHandler if not given
+    """
+    def __init__(self, start_date: str = FIRST_DATE, storage=None):
+        self._start_date = start_date
+        self._storage = storage
+        self._handler = None
+        self._items = {}
+        # futures of the loads in progress, the callers asking for the same key wait for the same load
+        self._loading = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple, load):
+        """
+        Returns the item stored under a given key, loads it first if it is missing.
+        The lock only guards the dictionaries, the loads run outside of it: concurrent first calls for a key
+        wait for one load instead of repeating it, while the calls for the other keys are not blocked by it.
+        """
+        version = self.get_handler().get_data_version()
+
+        with self._lock:
+            if version != self._version:
+                self._items.clear()
+                self._loading.clear()
+                self._version = version
+
+            if key in self._items:
+                return self._items[key]
+
+            future = self._loading.get(key)
+            is_owner = future is None
+
+            if is_owner:
+                future = self._loading[key] = Future()
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+            # an item loaded while the data changed is returned, but not stored under the new version
+            if version == self._version:
+                self._items[key] = value
+
+        future.set_result(value)
+
+        return value
+
+    def clear(self) -> None:
+        """Drops all the loaded data, the next calls read it again"""
+        with self._lock:
+            self._items.clear()
+            self._loading.clear()
+
+    def get_handler(self) -> dh.DataHandler:
+        with self._lock:
+            if self._handler is None:
+                self._handler = dh.DataHandler(start_date=self._start_date, storage=self._storage)
+
+            return self._handler
+
+    def get_tickers(self) -> list[str]:
+        return self._get(('tickers', ), lambda: sorted(self.get_handler().get_tickers()))
+
+    def get_info(self) -> pd.DataFrame:
+        """
+        :return: the companies' info, only the companies with a sector
+        """
+        return self._get(('info', ), lambda: self.get_handler().fetch_info_from_db())
+
+    def get_sectors(self) -> list[str]:
+        return self._get(('sectors', ), lambda: self.get_info()['sector'].unique().tolist())
+
+    def get_history(self) -> pd.DataFrame:
+        """
+        :return: the long frame of the stocks' open, high, low, close and adjusted close prices, indexed by date
+        """
+        return self._get(
+            ('history', )
+            , lambda: self.get_handler().fetch_stocks_from_db(
+                wide_format=False
+                , price_type='open, high, low, close, adj_close'
+            )
+        )
+
+    def get_partitions(self) -> SymbolPartitions:
+        """
+        :return: the stocks' history partitioned by symbol for the per-stock lookups
+        """
+        return self._get(('partitions', ), lambda: SymbolPartitions(self.get_history()))
+
+    def get_sector_cube(self) -> SectorCube:
+        """
+        :return: the date x sector aggregates of the adjusted close prices, see sector_cube
+        """
+        return self._get(('sector_cube', ), lambda: sector_cube(self.get_prices(), self.get_info()))
+
+    def get_prices(self, price_type: str = 'adj_close') -> pd.DataFrame:
+        """
+        :param price_type: one price type, such as low, high, close, adj_close
+        :return: the raw date x symbol price matrix of the full window, NaN where a price is missing
+        """
+        def load_prices():
+            matrix, dates, symbols = self.get_handler().fetch_price_matrix(price_type=price_type, dtype=np.float64)
+
+            return pd.DataFrame(matrix, index=dates, columns=symbols)
+
+        return self._get(('prices', price_type), load_prices)
+
+    def get_preprocessed(self, start_date: str = None, price_type: str = 'adj_close') -> pd.DataFrame:
+        """
+        :param start_date: first date of the window, the full window if not given
+        :param price_type: one price type, such as low, high, close, adj_close
+        :return: the prices of the window, preprocessed on their own as DataHandler.preprocess would
+        """
+        return self._get(
+            ('preprocessed', start_date, price_type)
+            , lambda: dh.preprocess_prices(self.get_prices(price_type).loc[start_date:])
+        )
+
+    def get_daily_returns(self, start_date: str = None) -> pd.DataFrame:
+        """
+        :param start_date: first date of the window, the full window if not given
+        :return: the daily returns of the window's adjusted close prices
+        """
+        return self._get(('daily', start_date), lambda: dh.daily_change(self.get_preprocessed(start_date)))
+
+    def get_monthly_returns(self, start_date: str = None) -> pd.DataFrame:
+        return self._get(('monthly', start_date), lambda: dh.monthly_change(self.get_daily_returns(start_date)))
+
+    def get_mean_var(self, daily_freq: bool = True) -> pd.DataFrame:
+        """
+        :param daily_freq: True for the daily returns, False for the monthly ones
+        :return: the stocks' mean return, vol, idiosyncratic share of the variance and sector
+        """
+        def load_mean_var():
+            returns = self.get_daily_returns() if daily_freq else self.get_monthly_returns()
+
+            return dh.mean_var_table(returns, self.get_info())
+
+        return self._get(('mean_var', daily_freq), load_mean_var)
+
+    def get_pca(self, start_date: str = None) -> dh.PCA:
+        """
+        :param start_date: first date of the window, the full window if not given
+        :return: the PCA model of the window's daily returns
+        """
+        return self._get(('pca', start_date), lambda: dh.PCA(data=self.get_daily_returns(start_date)))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def configure(start_date: str = FIRST_DATE, storage=None) -> MarketDataStore:
+    """
+    Replaces the process-wide store, e.g. with one reading a given storage backend
+    :param start_date: first date of the full window
+    :param storage: the backend the data are read from
+    :return: the new store
+    """
+    global _store
+
+    with _store_lock:
+        _store = MarketDataStore(start_date=start_date, storage=storage)
+
+        return _store
+
+
+def get_store() -> MarketDataStore:
+    """
+    :return: the process-wide store, created on the first call
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = MarketDataStore()
+
+        return _store
@@ -1,5 +1,5 @@
 from dash import Input, Output
-from pca_dax import data_handler as dh
+from pca_dax import market_data as md
 import plotly.express as px
 import plotly.graph_objects as go
 from pca_dax.common import COLORS
@@ -15,12 +15,12 @@ theme_template = go.Layout({
 })
 
 
+# first date of the window the PCA is fitted on, a slice of the shared store's full window
+PCA_START_DATE = '2020-01-01'
+
+
 def register_callbacks(dashapp):
-    data_instance = dh.DataHandler(
-        start_date='2020-01-01'
-    )
-    data = data_instance.create_daily_change()
-    pca_instance = dh.PCA(data=data)
+    store = md.get_store()
 
     @dashapp.callback(
         Output('first-five', 'figure')
@@ -32,7 +32,7 @@ def register_callbacks(dashapp):
         else:
             cov_mask = True
 
-        components = pca_instance.combine_loadings_sectors(cov_base=cov_mask, n_comp=10)
+        components = store.get_pca(PCA_START_DATE).combine_loadings_sectors(cov_base=cov_mask, n_comp=10)
         # dims = components.loc[:, components.columns != 'sector'].columns.to_list()
         dims = components.loc[:, components.columns.isin(['PC' + str(pc) for pc in range(1, 6)])].columns.to_list()
 
@@ -69,7 +69,7 @@ def register_callbacks(dashapp):
         else:
             cov_mask = True
 
-        components = pca_instance.combine_loadings_sectors(cov_base=cov_mask, n_comp=10)
+        components = store.get_pca(PCA_START_DATE).combine_loadings_sectors(cov_base=cov_mask, n_comp=10)
         dims = components.loc[:, components.columns != 'sector'].columns.to_list()
 
         fig = px.scatter_3d(
@@ -117,7 +117,7 @@ def register_callbacks(dashapp):
         else:
             cov_mask = True
 
-        components = pca_instance.transpose_loadings_sectors(cov_base=cov_mask, n_comp=10)
+        components = store.get_pca(PCA_START_DATE).transpose_loadings_sectors(cov_base=cov_mask, n_comp=10)
         filtered_data = components[components['component'] == component]
 
         fig = px.bar(
@@ -0,0 +1,625 @@
+import os
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from pca_dax import db
+from pca_dax import data_handler as dh
+from pca_dax import storage as st
+from pca_dax.common import FIRST_DATE, DATE_FORMAT
+
+
+# number of window slides after which the running sums are recomputed from the returns,
+# bounds the rounding error accumulated by the add/remove updates
+ROLLING_REFRESH_EVERY = 250
+
+# cap on the subspace iterations of one window, a window that does not converge within it is decomposed fully,
+# which happens when the window slides by many days at once or the components swap their order
+SUBSPACE_MAX_ITER = 30
+
+# file name of the online PCA model, stored next to the database
+ONLINE_PCA_FILE = 'online_pca.npz'
+
+# number of tasks the bootstrap replicas are split into, enough to balance the load of many workers,
+# it does not depend on the number of workers, so a seed gives the same replicas with any pool
+BOOTSTRAP_TASKS = 64
+
+# dates: last day of every window
+# symbols: the stocks, the order of the loadings' second axis
+# eigenvalues, explained_variance: windows x n_comp arrays
+# loadings: windows x stocks x n_comp array, the signs are aligned with the previous window
+# iterations: number of subspace iterations spent on every window, 0 for the fully decomposed ones
+RollingPCAResult = namedtuple(
+    'RollingPCAResult'
+    , ['dates', 'symbols', 'eigenvalues', 'explained_variance', 'loadings', 'iterations']
+)
+
+# reference: PCAResult of the whole sample, the replicas' signs are aligned with its loadings
+# n_boot: number of replicas
+# loadings_mean, loadings_std: stocks x n_comp dataframes of the replicas' loadings
+# eigenvalues, explained_variance: n_boot x n_comp arrays of the replicas
+# explained_variance_ci: 2 x n_comp array of the percentile interval's bounds
+BootstrapResult = namedtuple(
+    'BootstrapResult'
+    , ['reference', 'n_boot', 'loadings_mean', 'loadings_std', 'eigenvalues', 'explained_variance'
+       , 'explained_variance_ci']
+)
+
+
+def _subspace_iteration(mtrx: np.ndarray, q: np.ndarray, n_comp: int, tol: float
+                        , max_iter: int = SUBSPACE_MAX_ITER) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Refines an orthonormal starting block towards the leading eigenvectors of a symmetric matrix,
+    every iteration costs one N x N by N x p product
+    :param mtrx: symmetric N x N matrix
+    :param q: N x p orthonormal starting block, p >= n_comp
+    :param n_comp: number of eigenpairs that have to converge
+    :param tol: the iteration stops once every wanted eigenpair's residual norm is below tol times the largest eigenvalue
+    :param max_iter: maximal number of iterations
+    :return: a tuple of the p Ritz values in descending order, the N x p Ritz vectors and the spent iterations,
+        None instead of the iterations if the eigenpairs did not converge
+    """
+    for iteration in range(1, max_iter + 1):
+        z = mtrx @ q
+
+        # Rayleigh-Ritz: the best approximation of the eigenpairs within span(q)
+        eigvls, small_eigvecs = np.linalg.eigh(q.T @ z)
+        idx = np.argsort(eigvls)[::-1]
+        eigvls, small_eigvecs = eigvls[idx], small_eigvecs[:, idx]
+
+        q = q @ small_eigvecs
+        z = z @ small_eigvecs
+
+        residuals = np.linalg.norm(z[:, :n_comp] - q[:, :n_comp] * eigvls[:n_comp], axis=0)
+
+        if residuals.max() <= tol * abs(eigvls[0]):
+            return eigvls, q, iteration
+
+        q, _ = np.linalg.qr(z)
+
+    return eigvls, q, None
+
+
+class RollingPCA:
+    """
+    PCA over a window sliding through the returns.
+    The sums and the cross-products of the window's returns are updated by adding the entering days
+    and removing the leaving ones, and the eigenvectors of every window are refined from the previous window's ones,
+    so a slide costs O(step * N^2) for the update plus a few O(N^2 * n_comp) iterations instead of a refit.
+    """
+    def __init__(self, data: pd.DataFrame = None, window: int = 252, step: int = 1, cov_base: bool = False
+                 , n_comp: int = 10, tol: float = 1e-5, dtype=np.float32):
+        """
+        :param data: daily returns as returned by DataHandler.create_daily_change,
+            the whole DAX family since FIRST_DATE if not given
+        :param window: number of days in a window
+        :param step: number of days the window slides by
+        :param cov_base: use covariance matrix as an underlying base for PCA, correlation matrix otherwise
+        :param n_comp: number of components to track
+        :param tol: relative residual norm at which a window's eigenpairs count as converged,
+            the eigenvalues' relative error is of the order of its square
+        :param dtype: dtype of the returned loadings, float32 halves the size of a long roll
+        """
+        if data is None:
+            data = dh.DataHandler().create_daily_change()
+
+        n_days, n_stocks = data.shape
+
+        if not 1 < window <= n_days:
+            raise ValueError(f'The window should be between 2 and the number of days ({n_days})')
+
+        if step < 1:
+            raise ValueError('The step should be a positive number of days')
+
+        if not 0 < n_comp <= n_stocks:
+            raise ValueError(f'The number of components should be between 1 and the number of stocks ({n_stocks})')
+
+        if data.isna().to_numpy().any():
+            raise ValueError('The returns contain missing values, preprocess them first')
+
+        self._data = data
+        self._window = window
+        self._step = step
+        self._cov_base = cov_base
+        self._n_comp = n_comp
+        self._tol = tol
+        self._dtype = dtype
+
+    def _matrix(self, sums: np.ndarray, cross: np.ndarray) -> np.ndarray:
+        """Turns the window's sums and cross-products into its covariance or correlation matrix"""
+        n = self._window
+        mean = sums / n
+        mtrx = (cross - n * np.outer(mean, mean)) / (n - 1)
+
+        if self._cov_base:
+            return mtrx
+
+        std = np.sqrt(np.clip(np.diag(mtrx), 0, None))
+        # a stock without any price change in the window gets a zero row instead of NaNs
+        std[std == 0] = np.inf
+
+        return mtrx / np.outer(std, std)
+
+    def fit(self) -> RollingPCAResult:
+        """
+        Rolls the window through the returns, the first window ends at the window-th day
+        :return: a RollingPCAResult with the eigenvalue and the loading time series
+        """
+        # shifting by a constant leaves the covariances unchanged, but keeps the running sums small,
+        # so subtracting the squared mean from the cross-products loses fewer digits
+        x = self._data.to_numpy(dtype=np.float64)
+        x = x - x[:self._window].mean(axis=0)
+
+        n_stocks = x.shape[1]
+        n_comp = self._n_comp
+        n_block = min(n_stocks, n_comp + dh.RANDOMIZED_OVERSAMPLES)
+        window_ends = np.arange(self._window, len(x) + 1, self._step)
+        n_windows = len(window_ends)
+
+        eigenvalues = np.empty((n_windows, n_comp))
+        explained_variance = np.empty((n_windows, n_comp))
+        loadings = np.empty((n_windows, n_stocks, n_comp), dtype=self._dtype)
+        iterations = np.zeros(n_windows, dtype=np.int64)
+
+        sums = cross = q = None
+
+        for i, end in enumerate(window_ends):
+            start = end - self._window
+
+            if i == 0 or self._step >= self._window or i % ROLLING_REFRESH_EVERY == 0:
+                sums = x[start:end].sum(axis=0)
+                cross = x[start:end].T @ x[start:end]
+            else:
+                entering = x[end - self._step:end]
+                leaving = x[start - self._step:start]
+
+                sums += entering.sum(axis=0) - leaving.sum(axis=0)
+                cross += entering.T @ entering - leaving.T @ leaving
+
+            mtrx = self._matrix(sums, cross)
+
+            previous = None if q is None else q[:, :n_comp]
+            n_iter = None
+
+            if previous is not None:
+                eigvls, q, n_iter = _subspace_iteration(mtrx, q, n_comp=n_comp, tol=self._tol)
+
+            if n_iter is None:
+                eigvls, eigvecs = dh.decompose(mtrx, n_comp=n_block)
+                eigvls, q = eigvls[:n_block], eigvecs[:, :n_block]
+            else:
+                iterations[i] = n_iter
+
+            if previous is not None:
+                # an eigenvector is only defined up to its sign, keep the one closest to the previous window
+                flip = np.einsum('ij,ij->j', q[:, :n_comp], previous) < 0
+                q[:, :n_comp][:, flip] *= -1
+
+            eigenvalues[i] = eigvls[:n_comp]
+            explained_variance[i] = eigvls[:n_comp] / np.trace(mtrx)
+            loadings[i] = q[:, :n_comp]
+
+        return RollingPCAResult(
+            dates=self._data.index[window_ends - 1]
+            , symbols=self._data.columns
+            , eigenvalues=eigenvalues
+            , explained_variance=explained_variance
+            , loadings=loadings
+            , iterations=iterations
+        )
+
+
+def get_online_pca_path() -> str:
+    """
+    :return: path of the online PCA model, in the directory of the configured database
+    """
+    database = os.path.abspath(db.get_manager().get_database())
+
+    return os.path.join(os.path.dirname(database), ONLINE_PCA_FILE)
+
+
+class OnlinePCA:
+    """
+    PCA model that keeps the sufficient statistics of the daily returns, their weighted count, sums
+    and cross-products, together with the last seen prices. New trading days are folded into the statistics,
+    so the covariance and correlation matrices, and with them fresh loadings, are available without rereading
+    the history. With a half-life the older days are exponentially down-weighted, every day by the same factor.
+    """
+    def __init__(self, symbols, halflife: float = None):
+        """
+        :param symbols: the stocks tracked by the model
+        :param halflife: number of days after which a day's weight halves, equal weights if not given
+        """
+        if halflife is not None and halflife <= 0:
+            raise ValueError('The half-life should be a positive number of days')
+
+        n_stocks = len(symbols)
+
+        self._symbols = pd.Index(symbols)
+        self._halflife = halflife
+        self._count = 0
+        self._weight = 0.0
+        self._weight_sq = 0.0
+        self._sums = np.zeros(n_stocks)
+        self._cross = np.zeros((n_stocks, n_stocks))
+        self._first_day = None
+        self._last_day = None
+        self._last_prices = np.full(n_stocks, np.nan)
+
+    @property
+    def symbols(self) -> pd.Index:
+        return self._symbols
+
+    @property
+    def count(self) -> int:
+        """Number of the folded trading days"""
+        return self._count
+
+    @property
+    def last_date(self):
+        """Last folded trading day, None for an empty model"""
+        return None if self._last_day is None else db.from_day_numbers([self._last_day])[0]
+
+    def _decay(self, n_days) -> np.ndarray:
+        n_days = np.asarray(n_days, dtype=np.float64)
+
+        if self._halflife is None:
+            return np.ones_like(n_days)
+
+        return 0.5 ** (n_days / self._halflife)
+
+    def partial_fit(self, returns: np.ndarray) -> None:
+        """
+        Folds the returns of the following trading days into the statistics
+        :param returns: days x stocks array of returns in the order of the model's symbols, oldest day first
+        """
+        x = np.asarray(returns, dtype=np.float64)
+        n_days = len(x)
+
+        if n_days == 0:
+            return
+
+        # the j-th of n new days ends up with the weight decay ** (n - 1 - j), the kept statistics with decay ** n
+        weights = self._decay(np.arange(n_days - 1, -1, -1))
+        decay = float(self._decay(n_days))
+
+        self._count += n_days
+        self._weight = decay * self._weight + float(weights.sum())
+        self._weight_sq = decay ** 2 * self._weight_sq + float(np.square(weights).sum())
+        self._sums = decay * self._sums + weights @ x
+        self._cross = decay * self._cross + (x * weights[:, None]).T @ x
+
+    def update(self, prices: np.ndarray, days) -> int:
+        """
+        Folds the returns of the given prices into the statistics, the days that are already folded are skipped.
+        The missing prices are forward filled, a stock without a price yet contributes a zero return.
+        :param prices: days x stocks array of prices in the order of the model's symbols, NaN where missing
+        :param days: day numbers of the price rows, ascending
+        :return: number of the folded trading days
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        days = np.asarray(days, dtype=np.int64)
+
+        if self._last_day is not None:
+            new = days > self._last_day
+            prices, days = prices[new], days[new]
+
+        if len(days) == 0:
+            return 0
+
+        # the last seen prices come first, so the first new day gets a return as well
+        prices = pd.DataFrame(np.vstack([self._last_prices, prices])).ffill().to_numpy()
+        returns = np.nan_to_num(prices[1:] / prices[:-1] - 1, nan=0.0, posinf=0.0, neginf=0.0)
+
+        # an empty model has no prices to start from, its first day only sets them
+        if self._last_day is None:
+            returns = returns[1:]
+            self._first_day = int(days[min(1, len(days) - 1)])
+
+        self.partial_fit(returns)
+        self._last_prices = prices[-1]
+        self._last_day = int(days[-1])
+
+        return len(returns)
+
+    def update_from_db(self, storage=None) -> int:
+        """
+        Reads the adjusted close prices stored after the last folded day and folds their returns
+        :param storage: the backend the prices are read from, the sqlite database if not given
+        :return: number of the folded trading days
+        """
+        start_date = FIRST_DATE if self._last_day is None else \
+            db.from_day_numbers([self._last_day + 1])[0].strftime(DATE_FORMAT)
+
+        matrix, dates, symbols = dh.DataHandler(
+            tickers=self._symbols.to_list()
+            , start_date=start_date
+            , storage=storage if storage is not None else st.SQLiteStorage()
+        ).fetch_price_matrix(price_type='adj_close')
+
+        prices = pd.DataFrame(matrix, index=dates, columns=symbols).reindex(columns=self._symbols)
+
+        return self.update(prices.to_numpy(), db.to_day_numbers(dates))
+
+    @classmethod
+    def from_db(cls, halflife: float = None, storage=None):
+        """
+        Builds the model from the whole stored history of the stocks kept by DataHandler.preprocess,
+        i.e. the stocks used by the PCA class
+        :param halflife: number of days after which a day's weight halves, equal weights if not given
+        :param storage: the backend the prices are read from, the sqlite database if not given
+        :return: the new model
+        """
+        prices = dh.DataHandler(storage=storage if storage is not None else st.SQLiteStorage()).preprocess()
+
+        model = cls(prices.columns, halflife=halflife)
+        model.update(prices.to_numpy(), db.to_day_numbers(prices.index))
+
+        return model
+
+    def covariance(self) -> np.ndarray:
+        """
+        :return: the weighted covariance matrix, with the unbiased denominator for reliability weights,
+            n - 1 when all the weights are equal
+        """
+        if self._count < 2:
+            raise ValueError('The model needs at least two trading days')
+
+        mean = self._sums / self._weight
+
+        return (self._cross - self._weight * np.outer(mean, mean)) / (self._weight - self._weight_sq / self._weight)
+
+    def correlation(self) -> np.ndarray:
+        cov = self.covariance()
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        std[std == 0] = np.inf
+
+        return cov / np.outer(std, std)
+
+    def fingerprint(self) -> str:
+        """
+        :return: a hex digest identifying the state of the model
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array([self._count, self._weight, self._halflife or 0]).tobytes())
+        digest.update(self._sums.tobytes())
+        digest.update('\x1f'.join(map(str, self._symbols)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def fit(self, cov_base: bool = False, n_comp: int = 10) -> 'dh.PCAResult':
+        """
+        Decomposes the current covariance or correlation matrix
+        :param cov_base: use covariance matrix as an underlying base for PCA
+        :param n_comp: number of components to retain
+        :return: an immutable PCAResult, the same as the one of PCA.fit
+        """
+        mtrx = self.covariance() if cov_base else self.correlation()
+        eigvls, eigvecs = dh.decompose(mtrx, n_comp=n_comp)
+
+        return dh.PCAResult(
+            loadings=pd.DataFrame(
+                eigvecs[:, :n_comp]
+                , columns=['PC' + str(pc) for pc in range(1, n_comp + 1)]
+                , index=self._symbols
+            )
+            , eigenvalues=eigvls
+            , explained_variance=eigvls[:n_comp] / np.trace(mtrx)
+            , cov_base=cov_base
+            , window=tuple(db.from_day_numbers([self._first_day, self._last_day]))
+            , solver='online'
+            , fingerprint=self.fingerprint()
+        )
+
+    def save(self, path: str = None) -> None:
+        """
+        Writes the model to a temporary file first and swaps it in, so a reader never sees a half written model
+        :param path: file path, the default next to the database if not given
+        """
+        path = path or get_online_pca_path()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f
+                , symbols=np.array(self._symbols, dtype=str)
+                , halflife=np.nan if self._halflife is None else self._halflife
+                , count=self._count
+                , weight=self._weight
+                , weight_sq=self._weight_sq
+                , sums=self._sums
+                , cross=self._cross
+                , first_day=-1 if self._first_day is None else self._first_day
+                , last_day=-1 if self._last_day is None else self._last_day
+                , last_prices=self._last_prices
+            )
+
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = None):
+        """
+        :param path: file path, the default next to the database if not given
+        :return: the saved model
+        """
+        with np.load(path or get_online_pca_path()) as f:
+            halflife = float(f['halflife'])
+            model = cls(f['symbols'].tolist(), halflife=None if np.isnan(halflife) else halflife)
+
+            model._count = int(f['count'])
+            model._weight = float(f['weight'])
+            model._weight_sq = float(f['weight_sq'])
+            model._sums = f['sums']
+            model._cross = f['cross']
+            model._first_day = None if f['first_day'] < 0 else int(f['first_day'])
+            model._last_day = None if f['last_day'] < 0 else int(f['last_day'])
+            model._last_prices = f['last_prices']
+
+        return model
+
+
+# the returns of a bootstrap worker process, set once by the pool's initializer instead of being sent with every task
+_bootstrap_returns = None
+
+
+def _init_bootstrap_worker(returns: np.ndarray) -> None:
+    global _bootstrap_returns
+
+    _bootstrap_returns = returns
+
+
+def _resample_counts(rng: np.random.Generator, n_days: int, block_size: int) -> np.ndarray:
+    """
+    Draws the days of one replica as an index array and counts how many times every day was drawn,
+    blocks of consecutive days wrap around the end of the sample
+    """
+    if block_size == 1:
+        idx = rng.integers(0, n_days, size=n_days)
+    else:
+        starts = rng.integers(0, n_days, size=-(-n_days // block_size))
+        idx = ((starts[:, None] + np.arange(block_size)) % n_days).ravel()[:n_days]
+
+    return np.bincount(idx, minlength=n_days)
+
+
+def _bootstrap_chunk(seed: np.random.SeedSequence, n_replicas: int, block_size: int, cov_base: bool, n_comp: int
+                     , reference: np.ndarray) -> tuple:
+    """
+    Computes a chunk of replicas on the worker's returns and folds their loadings into running moments
+    :return: a tuple of the number of replicas, the loadings' mean and sum of squared deviations (Welford),
+        the replicas' eigenvalues and explained variance
+    """
+    x = _bootstrap_returns
+    n_days = len(x)
+    rng = np.random.default_rng(seed)
+
+    mean = np.zeros_like(reference)
+    m2 = np.zeros_like(reference)
+    eigenvalues = np.empty((n_replicas, n_comp))
+    explained_variance = np.empty((n_replicas, n_comp))
+    # the count-weighted returns, one buffer of the returns' size per worker reused by all its replicas
+    weighted = np.empty_like(x)
+
+    for i in range(n_replicas):
+        counts = _resample_counts(rng, n_days, block_size).astype(np.float64)
+
+        # a replica only weights the days by their counts, neither the drawn rows nor the resampled matrix are built
+        np.multiply(x, counts[:, None], out=weighted)
+
+        day_mean = counts @ x / n_days
+        mtrx = (weighted.T @ x - n_days * np.outer(day_mean, day_mean)) / (n_days - 1)
+
+        if not cov_base:
+            std = np.sqrt(np.clip(np.diag(mtrx), 0, None))
+            std[std == 0] = np.inf
+            mtrx = mtrx / np.outer(std, std)
+
+        eigvls, eigvecs = dh.decompose(mtrx, n_comp=n_comp)
+        loadings = eigvecs[:, :n_comp]
+        loadings[:, np.einsum('ij,ij->j', loadings, reference) < 0] *= -1
+
+        eigenvalues[i] = eigvls[:n_comp]
+        explained_variance[i] = eigvls[:n_comp] / np.trace(mtrx)
+
+        delta = loadings - mean
+        mean += delta / (i + 1)
+        m2 += delta * (loadings - mean)
+
+    return n_replicas, mean, m2, eigenvalues, explained_variance
+
+
+class BootstrapPCA:
+    """
+    Bootstrap of the PCA loadings and explained variance.
+    The replicas resample the days, or blocks of consecutive days to keep the returns' autocorrelation,
+    through index arrays over one shared returns array. The refits are spread over a process pool,
+    every worker receives the returns once and sends back running moments, so the memory does not grow
+    with the number of replicas.
+    """
+    def __init__(self, data: pd.DataFrame = None, n_boot: int = 1000, block_size: int = 1, cov_base: bool = False
+                 , n_comp: int = 10, max_workers: int = None, random_state=None):
+        """
+        :param data: daily returns, the whole DAX family since FIRST_DATE if not given
+        :param n_boot: number of replicas
+        :param block_size: number of consecutive days drawn together, 1 for the plain bootstrap
+        :param cov_base: use covariance matrix as an underlying base for PCA, correlation matrix otherwise
+        :param n_comp: number of components to retain
+        :param max_workers: number of worker processes, the number of CPUs if not given, 1 runs in this process
+        :param random_state: seed of the replicas, the results do not depend on the number of workers
+        """
+        if data is None:
+            data = dh.DataHandler().create_daily_change()
+
+        if n_boot < 2:
+            raise ValueError('The bootstrap needs at least two replicas')
+
+        if not 1 <= block_size <= len(data):
+            raise ValueError(f'The block size should be between 1 and the number of days ({len(data)})')
+
+        self._data = data
+        self._n_boot = n_boot
+        self._block_size = block_size
+        self._cov_base = cov_base
+        self._n_comp = n_comp
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._random_state = random_state
+
+    def _tasks(self) -> list[tuple[np.random.SeedSequence, int]]:
+        n_tasks = min(self._n_boot, BOOTSTRAP_TASKS)
+        sizes = np.diff(np.linspace(0, self._n_boot, n_tasks + 1).astype(int))
+        seeds = np.random.SeedSequence(self._random_state).spawn(n_tasks)
+
+        return list(zip(seeds, sizes.tolist()))
+
+    def fit(self, level: float = 0.95) -> BootstrapResult:
+        """
+        Runs the replicas
+        :param level: coverage of the explained variance's percentile interval
+        :return: a BootstrapResult
+        """
+        reference = dh.PCA(data=self._data).fit(cov_base=self._cov_base, n_comp=self._n_comp)
+        reference_loadings = reference.loadings.to_numpy()
+        x = self._data.to_numpy(dtype=np.float64)
+        args = (self._block_size, self._cov_base, self._n_comp, reference_loadings)
+
+        if self._max_workers == 1:
+            _init_bootstrap_worker(x)
+            chunks = [_bootstrap_chunk(seed, size, *args) for seed, size in self._tasks()]
+        else:
+            chunks = []
+
+            with ProcessPoolExecutor(self._max_workers, initializer=_init_bootstrap_worker, initargs=(x, )) as pool:
+                futures = {pool.submit(_bootstrap_chunk, seed, size, *args): i
+                           for i, (seed, size) in enumerate(self._tasks())}
+
+                for future in as_completed(futures):
+                    chunks.append((futures[future], future.result()))
+
+            chunks = [chunk for _, chunk in sorted(chunks, key=lambda c: c[0])]
+
+        # Chan's parallel combination of the chunks' moments
+        count, mean, m2 = 0, np.zeros_like(reference_loadings), np.zeros_like(reference_loadings)
+
+        for chunk_count, chunk_mean, chunk_m2, _, _ in chunks:
+            delta = chunk_mean - mean
+            total = count + chunk_count
+            mean = mean + delta * chunk_count / total
+            m2 = m2 + chunk_m2 + np.square(delta) * count * chunk_count / total
+            count = total
+
+        explained_variance = np.vstack([chunk[4] for chunk in chunks])
+
+        return BootstrapResult(
+            reference=reference
+            , n_boot=count
+            , loadings_mean=pd.DataFrame(mean, index=reference.loadings.index, columns=reference.loadings.columns)
+            , loadings_std=pd.DataFrame(
+                np.sqrt(m2 / (count - 1))
+                , index=reference.loadings.index
+                , columns=reference.loadings.columns
+            )
+            , eigenvalues=np.vstack([chunk[3] for chunk in chunks])
+            , explained_variance=explained_variance
+            , explained_variance_ci=np.quantile(explained_variance, [(1 - level) / 2, (1 + level) / 2], axis=0)
+        )
@@ -1,5 +1,7 @@
 DROP TABLE IF EXISTS companies;
 DROP TABLE IF EXISTS stocks;
+DROP TABLE IF EXISTS watermarks;
+DROP TABLE IF EXISTS backfill_checkpoints;
 
 CREATE TABLE companies (
     symbol VARCHAR(15) PRIMARY KEY,
@@ -13,16 +15,38 @@ CREATE TABLE companies (
     stock_index VARCHAR
 );
 
+-- clustered by the primary key, dates are stored as the number of days since 1970-01-01
 CREATE TABLE stocks (
-    date DATETIME NOT NULL,
-    symbol VARCHAR(15),
-    open DECIMAL(18, 4),
-    high DECIMAL(18, 4),
-    low DECIMAL(18, 4),
-    close DECIMAL(18, 4),
-    adj_close DECIMAL(18, 4),
+    symbol VARCHAR(15) NOT NULL,
+    date INTEGER NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    adj_close REAL,
     volume INTEGER DEFAULT 0,
     -- set up a composite PK consisting of symbol and date combination
-    CONSTRAINT con_symbol_date PRIMARY KEY(symbol, date),
+    PRIMARY KEY (symbol, date),
     FOREIGN KEY (symbol) REFERENCES companies(symbol)
+) WITHOUT ROWID;
+
+CREATE INDEX stocks_date_idx ON stocks (date);
+
+-- the last stored date of every symbol, used by update-db to download only the missing ranges
+CREATE TABLE watermarks (
+    symbol VARCHAR(15) PRIMARY KEY,
+    last_date DATETIME NOT NULL
 );
+
+-- the chunks already written by backfill-db, an interrupted backfill continues with the remaining ones
+CREATE TABLE backfill_checkpoints (
+    chunk_id VARCHAR NOT NULL,
+    start_date DATETIME NOT NULL,
+    end_date DATETIME NOT NULL,
+    symbols VARCHAR NOT NULL,
+    row_count INTEGER DEFAULT 0,
+    completed_at DATETIME,
+    PRIMARY KEY (chunk_id, start_date, end_date)
+);
+
+PRAGMA user_version = 2;
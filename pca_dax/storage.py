@@ -0,0 +1,298 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from pca_dax import db
+
+
+DEFAULT_SNAPSHOT_DIR = os.path.join('instance', 'snapshot')
+
+# columns of the stocks table copied into the snapshot
+SNAPSHOT_PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('The columnar snapshot requires pyarrow, install it with "pip install pyarrow"') from e
+
+    return pyarrow
+
+
+def is_pyarrow_available() -> bool:
+    try:
+        _import_pyarrow()
+    except ImportError:
+        return False
+
+    return True
+
+
+class SQLiteStorage:
+    """Reads the prices and the companies' info from the sqlite database, the source of truth"""
+
+    def get_version(self):
+        """
+        :return: a token that changes whenever the stored data change
+        """
+        return db.get_data_version()
+
+    def read_prices(self, symbols, start_day: int, end_day: int, columns: list[str]
+                    , dropna: bool = False) -> dict[str, np.ndarray]:
+        """
+        Reads the given price columns of the given symbols, sorted by symbol and date
+        :param symbols: iterable of symbols
+        :param start_day: first day number of the range
+        :param end_day: last day number of the range, inclusive
+        :param columns: price columns, as returned by db.parse_price_columns
+        :param dropna: skip the rows where any of the requested columns is missing
+        :return: a dictionary of 'symbol', 'date' (as day numbers) and the price columns mapped to arrays
+        """
+        not_null = ''.join(f' AND s.{col} IS NOT NULL' for col in columns) if dropna else ''
+
+        with db.read_connection() as conn:
+            db.load_symbol_filter(conn, symbols)
+
+            # CROSS JOIN makes sqlite seek the (symbol, date) key of every filtered symbol
+            rows = conn.execute(
+                f"""
+                    SELECT s.symbol, s.date, {', '.join(f's.{col}' for col in columns)}
+                    FROM temp.symbol_filter AS f
+                    CROSS JOIN stocks AS s ON s.symbol = f.symbol
+                    WHERE s.date BETWEEN ? AND ?{not_null}
+                    ORDER BY s.symbol, s.date
+                """
+                , (start_day, end_day)
+            ).fetchall()
+
+        n_rows = len(rows)
+        row_columns = list(zip(*rows)) if rows else [()] * (len(columns) + 2)
+
+        arrays = {
+            'symbol': np.asarray(row_columns[0], dtype=object)
+            , 'date': np.fromiter(row_columns[1], dtype=np.int64, count=n_rows)
+        }
+
+        for col, values in zip(columns, row_columns[2:]):
+            arrays[col] = np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=n_rows)
+
+        return arrays
+
+    def read_info(self, symbols) -> pd.DataFrame:
+        """
+        Reads the companies' info of the given symbols, skipping the companies without a sector
+        :param symbols: iterable of symbols
+        :return: a dataframe with the columns of the companies table
+        """
+        with db.read_connection() as conn:
+            db.load_symbol_filter(conn, symbols)
+
+            return pd.read_sql(
+                """
+                    SELECT c.*
+                    FROM companies AS c
+                    JOIN temp.symbol_filter AS f ON c.symbol = f.symbol
+                    WHERE c.sector IS NOT NULL
+                """
+                , con=conn
+            )
+
+
+class ParquetStorage:
+    """
+    Columnar snapshot of the prices and the companies' info, stored as parquet files.
+    The prices are partitioned by stock index and year, so date range reads only open the matching files
+    and only the requested columns are decoded. The snapshot is rebuilt from sqlite by refresh().
+    While the snapshot is missing, e.g. after clear() or while refresh() swaps the directories,
+    the reads and the version come from the sqlite database instead.
+    :param directory: snapshot directory, resolved from the app's SNAPSHOT_DIR config if not given
+    """
+    def __init__(self, directory: str = None):
+        self._directory = directory
+        self._fallback = SQLiteStorage()
+
+    def get_directory(self) -> str:
+        """
+        :return: the configured snapshot directory, falls back to the app's SNAPSHOT_DIR config,
+            the PCA_SNAPSHOT_DIR environment variable and the default instance path in this order
+        """
+        if self._directory is not None:
+            return self._directory
+
+        if has_app_context() and current_app.config.get('SNAPSHOT_DIR'):
+            return current_app.config['SNAPSHOT_DIR']
+
+        return os.environ.get('PCA_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR)
+
+    def _prices_path(self, directory: str = None) -> str:
+        return os.path.join(directory or self.get_directory(), 'prices')
+
+    def _info_path(self, directory: str = None) -> str:
+        return os.path.join(directory or self.get_directory(), 'companies.parquet')
+
+    def exists(self) -> bool:
+        return os.path.isdir(self._prices_path()) and os.path.isfile(self._info_path())
+
+    def get_version(self):
+        """
+        :return: a token that changes whenever the snapshot is refreshed, i.e. a new snapshot directory is swapped in,
+            the sqlite database's version tagged as such while the snapshot is missing
+        """
+        try:
+            stat = os.stat(self.get_directory())
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None or not self.exists():
+            return 'sqlite', self._fallback.get_version()
+
+        return stat.st_ino, stat.st_mtime_ns
+
+    def clear(self) -> None:
+        """Removes the snapshot, the reads fall back to sqlite until it is refreshed again"""
+        shutil.rmtree(self.get_directory(), ignore_errors=True)
+
+    def refresh(self) -> int:
+        """
+        Rebuilds the snapshot from the sqlite database, one year at a time.
+        The new snapshot is written next to the old one and swapped in once it is complete.
+        :return: number of written price rows
+        """
+        pa = _import_pyarrow()
+        directory = self.get_directory()
+        tmp_directory = directory + '.tmp'
+        n_rows = 0
+
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(self._prices_path(tmp_directory))
+
+        with db.read_connection() as conn:
+            pd.read_sql("""SELECT * FROM companies""", con=conn).to_parquet(self._info_path(tmp_directory), index=False)
+
+            years = conn.execute(
+                """
+                    SELECT DISTINCT CAST(strftime('%Y', date * 86400, 'unixepoch') AS INTEGER)
+                    FROM stocks
+                """
+            ).fetchall()
+
+            for (year, ) in sorted(years):
+                prices = pd.read_sql(
+                    f"""
+                        SELECT s.symbol, s.date, {', '.join(f's.{col}' for col in SNAPSHOT_PRICE_COLUMNS)}
+                            , COALESCE(c.stock_index, 'NONE') AS stock_index
+                            , {year} AS year
+                        FROM stocks AS s
+                        LEFT JOIN companies AS c ON s.symbol = c.symbol
+                        WHERE s.date BETWEEN ? AND ?
+                        ORDER BY s.symbol, s.date
+                    """
+                    , con=conn
+                    , params=(db.to_day_number(f'{year}-01-01'), db.to_day_number(f'{year}-12-31'))
+                )
+
+                pa.parquet.write_to_dataset(
+                    pa.Table.from_pandas(prices, preserve_index=False)
+                    , root_path=self._prices_path(tmp_directory)
+                    , partition_cols=['stock_index', 'year']
+                )
+
+                n_rows += len(prices)
+
+        old_directory = directory + '.old'
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+        if os.path.isdir(directory):
+            os.rename(directory, old_directory)
+
+        os.rename(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+        return n_rows
+
+    def read_prices(self, symbols, start_day: int, end_day: int, columns: list[str]
+                    , dropna: bool = False) -> dict[str, np.ndarray]:
+        """
+        Reads the given price columns of the given symbols, sorted by symbol and date,
+        only the partitions of the requested years are scanned
+        :param symbols: iterable of symbols
+        :param start_day: first day number of the range
+        :param end_day: last day number of the range, inclusive
+        :param columns: price columns, as returned by db.parse_price_columns
+        :param dropna: skip the rows where any of the requested columns is missing
+        :return: a dictionary of 'symbol', 'date' (as day numbers) and the price columns mapped to arrays
+        """
+        if not self.exists():
+            return self._fallback.read_prices(symbols, start_day, end_day, columns, dropna=dropna)
+
+        pa = _import_pyarrow()
+        ds = pa.dataset
+        start_year = db.from_day_numbers([start_day])[0].year
+        end_year = db.from_day_numbers([end_day])[0].year
+
+        dataset = ds.dataset(self._prices_path(), format='parquet', partitioning='hive')
+
+        row_filter = (
+            (ds.field('year') >= start_year) & (ds.field('year') <= end_year)
+            & (ds.field('date') >= start_day) & (ds.field('date') <= end_day)
+            & ds.field('symbol').isin(list(symbols))
+        )
+
+        if dropna:
+            for col in columns:
+                row_filter &= ds.field(col).is_valid()
+
+        table = (dataset
+                 .to_table(columns=['symbol', 'date', *columns], filter=row_filter)
+                 .sort_by([('symbol', 'ascending'), ('date', 'ascending')]))
+
+        arrays = {
+            'symbol': table.column('symbol').to_numpy().astype(object)
+            , 'date': table.column('date').to_numpy().astype(np.int64)
+        }
+
+        for col in columns:
+            # missing prices come back as NaN
+            arrays[col] = table.column(col).cast(pa.float64()).to_numpy()
+
+        return arrays
+
+    def read_info(self, symbols) -> pd.DataFrame:
+        """
+        Reads the companies' info of the given symbols, skipping the companies without a sector
+        :param symbols: iterable of symbols
+        :return: a dataframe with the columns of the companies table
+        """
+        if not self.exists():
+            return self._fallback.read_info(symbols)
+
+        info = pd.read_parquet(self._info_path())
+
+        return info[info['symbol'].isin(set(symbols)) & info['sector'].notna()].reset_index(drop=True)
+
+
+def get_default_storage():
+    """
+    :return: the columnar snapshot if it has been built and pyarrow is installed, the sqlite database otherwise
+    """
+    snapshot = ParquetStorage()
+
+    if snapshot.exists() and is_pyarrow_available():
+        return snapshot
+
+    return SQLiteStorage()
+
+
+def refresh_snapshot() -> int:
+    """
+    Rebuilds the columnar snapshot if pyarrow is installed
+    :return: number of written price rows, -1 if pyarrow is missing
+    """
+    if not is_pyarrow_available():
+        return -1
+
+    return ParquetStorage().refresh()
@@ -1,101 +1,161 @@
+import json
 import requests
 import urllib
-from ratelimiter import RateLimiter
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pca_dax import http_cache
+
+
+# the crumb stays valid as long as the cookie does, it is refreshed earlier to be on the safe side
+CRUMB_TTL = 60 * 60
+DEFAULT_RATE = 2
+DEFAULT_WORKERS = 4
+
+InfoResult = namedtuple('InfoResult', ['symbol', 'info', 'error'])
 
 
-@RateLimiter(max_calls=1, period=1)
 def get_ticker(company_name):
     yfinance = 'https://query2.finance.yahoo.com/v1/finance/search'
-    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
     params = {
         'q': company_name
         , 'quotes_count': 1
         , 'country': 'United States'
     }
 
-    res = requests.get(url=yfinance, params=params, headers={'User-Agent': user_agent})
+    # only the requests that miss the cache are rate limited
+    res = http_cache.get_cache().get(url=yfinance, params=params, parse=json.loads, limiter=_search_limiter)
     try:
-        return res.json()['quotes'][0]['symbol']
+        return res['quotes'][0]['symbol']
     except (IndexError, KeyError) as e:
         return None
 
 
-class Ticker:
-    user_agent_key = "User-Agent"
-    user_agent_value = ("Mozilla/5.0 (Windows NT 6.1; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/58.0.3029.110 Safari/537.36")
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter, shared by all the threads doing requests to Yahoo
+    :param rate: number of tokens added per second
+    :param capacity: maximum number of tokens, i.e. the allowed burst size
+    """
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: float = None):
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
 
-    def __init__(self, ticker):
-        self.yahoo_ticker = ticker
+    def acquire(self) -> None:
+        """Blocks until a token is available and consumes it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+                self._last = now
 
-    def __str__(self):
-        return self.yahoo_ticker
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
 
-    def _get_yahoo_cookie(self):
-        cookie = None
+                wait = (1 - self._tokens) / self._rate
 
-        headers = {self.user_agent_key: self.user_agent_value}
-        response = requests.get("https://fc.yahoo.com",
-                                headers=headers,
-                                allow_redirects=True)
+            time.sleep(wait)
 
-        if not response.cookies:
-            raise Exception("Failed to obtain Yahoo auth cookie.")
 
-        cookie = list(response.cookies)[0]
+_search_limiter = TokenBucket(rate=1, capacity=1)
+
 
-        return cookie
+class YahooSession:
+    """
+    Keeps one HTTP session with a single cookie/crumb pair for all the quoteSummary requests,
+    the pair is refreshed only once it expires or Yahoo rejects it
+    :param limiter: rate limiter applied to every request, a new TokenBucket if not given
+    :param crumb_ttl: number of seconds after which the crumb is refreshed
+    """
+    user_agent_key = "User-Agent"
+    user_agent_value = ("Mozilla/5.0 (Windows NT 6.1; Win64; x64) "
+                        "AppleWebKit/537.36 (KHTML, like Gecko) "
+                        "Chrome/58.0.3029.110 Safari/537.36")
 
-    def _get_yahoo_crumb(self, cookie):
-        crumb = None
+    def __init__(self, limiter: TokenBucket = None, crumb_ttl: float = CRUMB_TTL):
+        self._limiter = limiter if limiter is not None else TokenBucket()
+        self._crumb_ttl = crumb_ttl
+        self._crumb = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.headers.update({self.user_agent_key: self.user_agent_value})
 
-        headers = {self.user_agent_key: self.user_agent_value}
+    def _refresh_crumb(self) -> None:
+        # the cookie is kept by the session and sent with every following request
+        response = self._session.get("https://fc.yahoo.com", allow_redirects=True)
 
-        crumb_response = requests.get(
-            "https://query1.finance.yahoo.com/v1/test/getcrumb",
-            headers=headers,
-            cookies={cookie.name: cookie.value},
-            allow_redirects=True,
+        if not response.cookies and not self._session.cookies:
+            raise Exception("Failed to obtain Yahoo auth cookie.")
+
+        crumb_response = self._session.get(
+            "https://query1.finance.yahoo.com/v1/test/getcrumb"
+            , allow_redirects=True
         )
         crumb = crumb_response.text
 
-        if crumb is None:
+        if not crumb:
             raise Exception("Failed to retrieve Yahoo crumb.")
 
-        return crumb
-
-    @property
-    @RateLimiter(max_calls=1, period=1)
-    def info(self):
+        self._crumb = crumb
+        self._expires_at = time.monotonic() + self._crumb_ttl
+
+    def get_crumb(self, force_refresh: bool = False) -> str:
+        """
+        Returns the current crumb, fetches a new cookie/crumb pair if it is missing or expired
+        :param force_refresh: fetch a new pair regardless of its age
+        :return: the crumb string
+        """
+        with self._lock:
+            if force_refresh or self._crumb is None or time.monotonic() >= self._expires_at:
+                self._refresh_crumb()
+
+            return self._crumb
+
+    def quote_summary(self, ticker: str) -> dict:
+        """
+        Fetches the company info of a given ticker from the quoteSummary endpoint
+        :param ticker: Yahoo ticker
+        :return: a flat dictionary with the info fields
+        """
         # Yahoo modules doc information:
         # https://cryptocointracker.com/yahoo-finance/yahoo-finance-api
-        cookie = self._get_yahoo_cookie()
-        crumb = self._get_yahoo_crumb(cookie)
-        info = {}
-        ret = {}
-
-        headers = {self.user_agent_key: self.user_agent_value}
-
         yahoo_modules = ("financialData,"
                          "quoteType,"
                          "defaultKeyStatistics,"
                          "assetProfile,"
                          "summaryDetail")
 
-        url = ("https://query1.finance.yahoo.com/v10/finance/"
-               f"quoteSummary/{self.yahoo_ticker}"
-               f"?modules={urllib.parse.quote_plus(yahoo_modules)}"
-               f"&ssl=true&crumb={urllib.parse.quote_plus(crumb)}")
+        crumb = self.get_crumb()
+
+        for attempt in range(2):
+            url = ("https://query1.finance.yahoo.com/v10/finance/"
+                   f"quoteSummary/{ticker}"
+                   f"?modules={urllib.parse.quote_plus(yahoo_modules)}"
+                   f"&ssl=true&crumb={urllib.parse.quote_plus(crumb)}")
 
-        info_response = requests.get(url,
-                                     headers=headers,
-                                     cookies={cookie.name: cookie.value},
-                                     allow_redirects=True)
+            self._limiter.acquire()
+            info_response = self._session.get(url, allow_redirects=True)
+
+            # an expired crumb is rejected as unauthorized, retry once with a fresh one
+            if info_response.status_code == 401 and attempt == 0:
+                crumb = self.get_crumb(force_refresh=True)
+                continue
+
+            break
+
+        info_response.raise_for_status()
 
         info = info_response.json()
         info = info['quoteSummary']['result'][0]
 
+        ret = {}
+
         for mainKeys in info.keys():
             for key in info[mainKeys].keys():
                 if isinstance(info[mainKeys][key], dict):
@@ -107,3 +167,54 @@ class Ticker:
                     ret[key] = info[mainKeys][key]
 
         return ret
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_session() -> YahooSession:
+    """Returns the process-wide Yahoo session, creates it on the first call"""
+    global _default_session
+
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = YahooSession()
+
+    return _default_session
+
+
+def fetch_infos(tickers, max_workers: int = DEFAULT_WORKERS, session: YahooSession = None) -> list[InfoResult]:
+    """
+    Fetches the company info for many tickers concurrently, sharing one session and one rate limiter
+    :param tickers: iterable of Yahoo tickers
+    :param max_workers: number of threads doing the requests
+    :param session: Yahoo session to be used, the process-wide one if not given
+    :return: a list of InfoResult tuples in the order of the given tickers,
+        with either the info dictionary or the raised exception filled in
+    """
+    session = session if session is not None else get_session()
+
+    def fetch_one(ticker):
+        try:
+            return InfoResult(ticker, session.quote_summary(ticker), None)
+        except Exception as e:
+            return InfoResult(ticker, None, e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch_one, tickers))
+
+
+class Ticker:
+    def __init__(self, ticker, session: YahooSession = None):
+        self.yahoo_ticker = ticker
+        self._session = session
+
+    def __str__(self):
+        return self.yahoo_ticker
+
+    @property
+    def info(self):
+        session = self._session if self._session is not None else get_session()
+
+        return session.quote_summary(self.yahoo_ticker)
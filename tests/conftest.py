@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pca_dax import db
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Points the process-wide connection manager to an empty database with the current schema"""
+    path = str(tmp_path / 'test.sqlite')
+    db.configure(database=path)
+
+    with open(os.path.join(os.path.dirname(db.__file__), 'schema.sql')) as f:
+        db.create_connection().executescript(f.read())
+
+    yield path
+
+    db.configure()
+
+
+SYMBOLS = ['AAA.DE', 'BBB.DE']
+
+
+@pytest.fixture
+def stocks(database):
+    conn = db.create_connection()
+    conn.executemany(
+        """INSERT INTO companies (symbol, name, sector, market_cap, stock_index) VALUES (?, ?, ?, ?, ?)"""
+        , [(symbol, symbol, 'Tech', 100, 'DAX') for symbol in SYMBOLS]
+    )
+    conn.commit()
+
+    dates = pd.bdate_range('2023-01-02', periods=60)
+    prices = np.linspace(100, 120, len(dates))
+    db.insert_stocks_bulk(
+        pd.concat([
+            pd.DataFrame({
+                'Date': dates, 'Symbol': symbol, 'Open': prices, 'High': prices, 'Low': prices, 'Close': prices
+                , 'Adj Close': prices * (i + 1), 'Volume': 1
+            })
+            for i, symbol in enumerate(SYMBOLS)
+        ])
+        , conn=conn
+    )
+
+    return dates
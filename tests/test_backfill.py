@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import requests
+from pca_dax import db
+from pca_dax import data_handler as dh
+
+SYMBOLS = ['AAA.DE', 'BBB.DE', 'CCC.DE']
+
+
+class FakeTicker:
+    # symbols whose next download fails
+    failing = set()
+
+    def __init__(self, symbol):
+        self._symbol = symbol
+
+    def history(self, start, end, **kwargs):
+        if self._symbol in self.failing:
+            raise requests.ConnectionError(f'{self._symbol}: connection reset')
+
+        dates = pd.bdate_range(start, end, inclusive='left', tz='Europe/Berlin')
+        prices = np.linspace(100, 110, len(dates))
+
+        return pd.DataFrame(
+            {'Open': prices, 'High': prices, 'Low': prices, 'Close': prices, 'Adj Close': prices, 'Volume': 1}
+            , index=pd.DatetimeIndex(dates, name='Date')
+        )
+
+
+def count_rows(symbol: str) -> int:
+    return db.create_connection().execute("""SELECT COUNT(*) FROM stocks WHERE symbol = ?""", (symbol, )).fetchone()[0]
+
+
+def test_failed_ticker_is_retried_by_the_next_run(database, monkeypatch):
+    monkeypatch.setattr(dh.yf, 'Ticker', FakeTicker)
+    monkeypatch.setattr(dh.DataHandler, 'get_tickers', lambda self: self._tickers or set(SYMBOLS))
+    kwargs = dict(chunk_size=3, slice_years=1, start_date='2024-01-01', max_workers=2, ticker_workers=3)
+
+    monkeypatch.setattr(FakeTicker, 'failing', {'BBB.DE'})
+    _, failed = db.backfill_stocks(**kwargs)
+
+    assert failed and all(symbols == ['BBB.DE'] for symbols, _, _ in failed)
+    assert count_rows('BBB.DE') == 0
+    assert count_rows('AAA.DE') > 0
+    assert db.create_connection().execute("""SELECT COUNT(*) FROM backfill_checkpoints""").fetchone()[0] == 0
+
+    monkeypatch.setattr(FakeTicker, 'failing', set())
+    counts, failed = db.backfill_stocks(**kwargs)
+
+    assert failed == []
+    assert count_rows('BBB.DE') == count_rows('AAA.DE')
+    assert counts['inserted'] == count_rows('BBB.DE')
+
+
+def test_slices_follow_a_fixed_grid():
+    today = db._date_slices('2020-01-01', '2026-10-19', 3)
+    next_week = db._date_slices('2020-01-01', '2026-10-26', 3)
+
+    assert today == next_week == [
+        ('2020-01-01', '2023-01-01'), ('2023-01-01', '2026-01-01'), ('2026-01-01', '2029-01-01')
+    ]
+
+
+def test_resumed_run_on_a_later_day_skips_completed_chunks(database, monkeypatch):
+    downloads = []
+
+    class CountingTicker(FakeTicker):
+        def history(self, start, end, **kwargs):
+            downloads.append((self._symbol, start, end))
+
+            return super().history(start, end, **kwargs)
+
+    class Today(db.datetime):
+        day = db.datetime(2024, 6, 3)
+
+        @classmethod
+        def today(cls):
+            return cls.day
+
+    monkeypatch.setattr(dh.yf, 'Ticker', CountingTicker)
+    monkeypatch.setattr(dh.DataHandler, 'get_tickers', lambda self: self._tickers or set(SYMBOLS))
+    monkeypatch.setattr(db, 'datetime', Today)
+    kwargs = dict(chunk_size=3, slice_years=1, start_date='2023-01-01', max_workers=1, ticker_workers=1)
+
+    db.backfill_stocks(**kwargs)
+
+    # the last download stops at tomorrow, not at the grid boundary
+    assert max(end for _, _, end in downloads) == '2024-06-04'
+
+    downloads.clear()
+    Today.day = db.datetime(2024, 6, 10)
+    _, failed = db.backfill_stocks(**kwargs)
+
+    assert failed == []
+    assert downloads == []
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from pca_dax import pca_engines as pe
+
+
+@pytest.mark.parametrize('cov_base', [True, False])
+@pytest.mark.parametrize('block_size', [1, 5])
+def test_replica_matches_the_resampled_matrix(cov_base, block_size):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((120, 6)) @ rng.standard_normal((6, 6))
+    seed = np.random.SeedSequence(1)
+    pe._init_bootstrap_worker(x)
+
+    _, _, _, eigenvalues, _ = pe._bootstrap_chunk(seed, 1, block_size, cov_base, 3, np.eye(6)[:, :3])
+
+    counts = pe._resample_counts(np.random.default_rng(seed), len(x), block_size)
+    resampled = np.repeat(x, counts, axis=0)
+    mtrx = np.cov(resampled, rowvar=False) if cov_base else np.corrcoef(resampled, rowvar=False)
+
+    np.testing.assert_allclose(eigenvalues[0], np.linalg.eigvalsh(mtrx)[::-1][:3])
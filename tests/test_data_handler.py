@@ -0,0 +1,38 @@
+import sqlite3
+from pca_dax import db
+from pca_dax import storage as st
+from pca_dax.data_handler import DataHandler
+from tests.conftest import SYMBOLS
+
+
+def make_handler() -> DataHandler:
+    return DataHandler(tickers=set(SYMBOLS), start_date='2023-01-01', end_date='2023-12-31'
+                       , storage=st.SQLiteStorage())
+
+
+def test_repeated_calls_are_cached(stocks):
+    handler = make_handler()
+
+    assert handler.create_daily_change() is handler.create_daily_change()
+    assert handler.create_monthly_change() is handler.create_monthly_change()
+
+
+def test_commit_on_another_connection_clears_the_cache(stocks, database):
+    handler = make_handler()
+    returns = handler.create_daily_change()
+    version = db.get_data_version()
+
+    assert any(key[0] == 'daily' for key in handler._derived)
+
+    # update-db writes through its own connection, the probe only sees the committed change
+    conn = sqlite3.connect(database)
+    conn.execute("""UPDATE stocks SET adj_close = adj_close * 2 WHERE symbol = ?""", (SYMBOLS[0], ))
+    conn.commit()
+    conn.close()
+
+    assert db.get_data_version() != version
+
+    handler.fetch_info_from_db()
+
+    assert not any(key[0] == 'daily' for key in handler._derived)
+    assert handler.create_daily_change() is not returns
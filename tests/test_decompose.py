@@ -0,0 +1,47 @@
+import warnings
+import numpy as np
+import pytest
+from pca_dax.data_handler import decompose
+
+
+def make_matrix(spectrum: np.ndarray, seed: int = 0) -> np.ndarray:
+    q, _ = np.linalg.qr(np.random.default_rng(seed).standard_normal((len(spectrum), len(spectrum))))
+
+    return (q * spectrum) @ q.T
+
+
+def assert_matches_full(mtrx: np.ndarray, n_comp: int, solver: str) -> None:
+    full_eigvls, full_eigvecs = decompose(mtrx, n_comp)
+    eigvls, eigvecs = decompose(mtrx, n_comp, solver=solver, random_state=0)
+
+    np.testing.assert_allclose(eigvls[:n_comp], full_eigvls[:n_comp], rtol=1e-10, atol=1e-12)
+    # the same subspace, whatever the signs and the rotation within degenerate eigenvalues
+    np.testing.assert_allclose(
+        np.linalg.svd(full_eigvecs[:, :n_comp].T @ eigvecs[:, :n_comp], compute_uv=False), 1, atol=1e-6
+    )
+
+
+@pytest.mark.parametrize('solver', ['truncated', 'randomized'])
+def test_separated_spectrum(solver):
+    spectrum = np.concatenate(([40., 20., 10., 5., 2.5], np.full(195, 0.1)))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert_matches_full(make_matrix(spectrum), 5, solver)
+
+
+@pytest.mark.parametrize('solver', ['truncated', 'randomized'])
+def test_flat_tail(solver):
+    # the wanted eigenvalues 6 to 10 lie in a nearly flat bulk, where the power iterations barely converge
+    spectrum = np.concatenate(([40., 20., 10., 5., 2.5], np.linspace(1.02, 1., 195)))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        assert_matches_full(make_matrix(spectrum), 10, solver)
+
+
+def test_randomized_warns_when_not_converged():
+    spectrum = np.concatenate(([40., 20., 10., 5., 2.5], np.linspace(1.02, 1., 195)))
+
+    with pytest.warns(RuntimeWarning, match='did not converge'):
+        decompose(make_matrix(spectrum), 10, solver='randomized', random_state=0)
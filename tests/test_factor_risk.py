@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from pca_dax.data_handler import PCAResult
+from pca_dax.factor_risk import FactorProjector
+
+
+def make_result(loadings: pd.DataFrame) -> PCAResult:
+    return PCAResult(
+        loadings=loadings
+        , eigenvalues=np.ones(loadings.shape[1])
+        , explained_variance=np.ones(loadings.shape[1])
+        , cov_base=False
+        , window=None
+        , solver='full'
+        , fingerprint='test'
+    )
+
+
+def test_absent_column_equals_all_nan_column():
+    projector = FactorProjector(make_result(pd.DataFrame({'PC1': [0.6, 0.8]}, index=['A', 'B'])))
+    days = pd.bdate_range('2024-01-01', periods=3)
+
+    absent = projector.transform(pd.DataFrame({'A': [1.0, 2.0, -1.0]}, index=days))
+    all_nan = projector.transform(pd.DataFrame({'A': [1.0, 2.0, -1.0], 'B': np.nan}, index=days))
+
+    pd.testing.assert_frame_equal(absent, all_nan)
+    # only 0.36 of the squared loadings is observed, below the default coverage
+    assert absent['PC1'].isna().all()
+
+
+def test_absent_column_is_renormalized_away():
+    loadings = pd.DataFrame({'PC1': [0.6, 0.8, 0.0], 'PC2': [0.0, 0.0, 1.0]}, index=['A', 'B', 'C'])
+    projector = FactorProjector(make_result(loadings), min_coverage=0.3)
+    days = pd.bdate_range('2024-01-01', periods=2)
+
+    scores = projector.transform(pd.DataFrame({'C': [0.5, 0.2], 'A': [1.0, 2.0], 'X': [9.0, 9.0]}, index=days))
+
+    # the observed stocks' least squares fit: 0.6 * r_A / 0.6 ** 2
+    np.testing.assert_allclose(scores['PC1'], np.array([1.0, 2.0]) / 0.6)
+    np.testing.assert_allclose(scores['PC2'], [0.5, 0.2])
+
+
+def test_full_coverage_equals_projection():
+    rng = np.random.default_rng(0)
+    loadings = pd.DataFrame(np.linalg.qr(rng.standard_normal((6, 2)))[0], index=list('ABCDEF'), columns=['PC1', 'PC2'])
+    returns = pd.DataFrame(rng.standard_normal((5, 6)), columns=list('FEDCBA'))
+
+    scores = FactorProjector(make_result(loadings)).transform(returns)
+
+    np.testing.assert_allclose(scores.to_numpy(), returns[loadings.index].to_numpy() @ loadings.to_numpy())
@@ -0,0 +1,129 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pca_dax import market_data as md
+
+
+class FakeHandler:
+    version = 1
+
+    def get_data_version(self):
+        return self.version
+
+
+def make_store() -> md.MarketDataStore:
+    store = md.MarketDataStore()
+    store._handler = FakeHandler()
+
+    return store
+
+
+def test_slow_load_does_not_block_other_keys():
+    store = make_store()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_load():
+        started.set()
+        release.wait(timeout=10)
+
+        return 'slow'
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(store._get, ('slow', ), slow_load)
+        assert started.wait(timeout=10)
+
+        # answered while the slow load is still in progress
+        assert store._get(('fast', ), lambda: 'fast') == 'fast'
+        assert not slow.done()
+
+        release.set()
+        assert slow.result(timeout=10) == 'slow'
+
+
+def test_concurrent_first_calls_load_once():
+    store = make_store()
+    calls = []
+    release = threading.Event()
+
+    def load():
+        calls.append(1)
+        release.wait(timeout=10)
+
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(store._get, ('item', ), load) for _ in range(8)]
+        release.set()
+        results = [future.result(timeout=10) for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_new_data_version_reloads():
+    store = make_store()
+    first = store._get(('item', ), object)
+
+    assert store._get(('item', ), object) is first
+
+    store._handler.version = 2
+
+    assert store._get(('item', ), object) is not first
+
+
+def make_prices_and_info():
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2024-01-01', periods=30)
+    symbols = ['A1', 'A2', 'B1', 'B2', 'C1', 'X1']
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (30, 6)), axis=0)), index=dates, columns=symbols)
+    prices.iloc[:5, 1] = np.nan
+    prices.iloc[10, 2] = np.nan
+
+    info = pd.DataFrame({
+        'symbol': ['A1', 'A2', 'B1', 'B2', 'C1', 'X1']
+        , 'sector': ['Autos', 'Autos', 'Banks', 'Banks', 'Chemicals', None]
+        , 'market_cap': [300., 100., 50., None, None, 10.]
+    })
+
+    return prices, info
+
+
+def test_sector_cube_mean_price_matches_groupby():
+    prices, info = make_prices_and_info()
+    cube = md.sector_cube(prices, info)
+
+    expected = (
+        prices.rename_axis('date').reset_index()
+        .melt(id_vars='date', var_name='symbol', value_name='adj_close')
+        .dropna()
+        .merge(info[['symbol', 'sector']].dropna(), on='symbol')
+        .groupby(['date', 'sector'])['adj_close'].mean()
+        .unstack()
+    )
+
+    pd.testing.assert_frame_equal(cube.mean_price, expected, check_names=False, check_freq=False)
+
+
+def test_sector_cube_return_indices():
+    prices, info = make_prices_and_info()
+    cube = md.sector_cube(prices, info)
+    returns = prices / prices.shift(1) - 1
+
+    autos = returns[['A1', 'A2']]
+    equal = autos.mean(axis=1).fillna(0)
+    cap = (autos * [300., 100.]).sum(axis=1) / (autos.notna() * [300., 100.]).sum(axis=1)
+
+    np.testing.assert_allclose(cube.equal_weighted['Autos'], 100 * (1 + equal).cumprod())
+    np.testing.assert_allclose(cube.cap_weighted['Autos'], 100 * (1 + cap.fillna(0)).cumprod())
+    # only B1 has a market cap, so the cap-weighted Banks index follows it alone, skipping its missing day
+    np.testing.assert_allclose(cube.cap_weighted['Banks'], 100 * (1 + returns['B1'].fillna(0)).cumprod())
+
+
+def test_sector_without_market_caps_is_missing():
+    prices, info = make_prices_and_info()
+    cube = md.sector_cube(prices, info)
+
+    assert cube.cap_weighted['Chemicals'].isna().all()
+    assert cube.equal_weighted['Chemicals'].notna().all()
+    assert 'X1' not in cube.mean_price.columns
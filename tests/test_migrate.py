@@ -0,0 +1,75 @@
+import sqlite3
+import pytest
+from pca_dax import db
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'legacy.sqlite'))
+    conn.executescript(
+        """
+            CREATE TABLE stocks (
+                date DATETIME NOT NULL,
+                symbol VARCHAR(15),
+                open DECIMAL(18, 4),
+                high DECIMAL(18, 4),
+                low DECIMAL(18, 4),
+                close DECIMAL(18, 4),
+                adj_close DECIMAL(18, 4),
+                volume INTEGER DEFAULT 0,
+                CONSTRAINT con_symbol_date PRIMARY KEY(symbol, date)
+            );
+
+            INSERT INTO stocks VALUES ('2020-01-02 00:00:00', 'AAA.DE', 1, 1, 1, 1, 1, 10);
+            INSERT INTO stocks VALUES ('2020-01-02 12:00:00', 'AAA.DE', 2, 2, 2, 2, 2, 20);
+            INSERT INTO stocks VALUES ('2020-01-03 00:00:00', 'AAA.DE', 3, 3, 3, 3, 3, 30);
+            INSERT INTO stocks VALUES ('2020-01-02 00:00:00', 'BBB.DE', 4, 4, 4, 4, 4, 40);
+        """
+    )
+
+    yield conn
+
+    conn.close()
+
+
+def test_same_day_rows_keep_the_latest(legacy):
+    assert db.migrate_db(legacy) == 3
+    assert db.get_schema_version(legacy) == db.SCHEMA_VERSION
+
+    rows = legacy.execute("""SELECT symbol, date, adj_close, volume FROM stocks ORDER BY symbol, date""").fetchall()
+    day = db.to_day_number('2020-01-02')
+
+    assert rows == [('AAA.DE', day, 2.0, 20), ('AAA.DE', day + 1, 3.0, 30), ('BBB.DE', day, 4.0, 40)]
+
+
+def test_failed_migration_rolls_back_and_can_be_retried(legacy):
+    # a view takes the name of the index the migration creates, so the script fails after copying the rows
+    legacy.execute("""CREATE VIEW stocks_date_idx AS SELECT 1""")
+    legacy.commit()
+
+    with pytest.raises(sqlite3.OperationalError):
+        db.migrate_db(legacy)
+
+    assert not legacy.in_transaction
+    assert db.get_schema_version(legacy) == 0
+    assert legacy.execute("""SELECT COUNT(*) FROM sqlite_master WHERE name = 'stocks_v2'""").fetchone()[0] == 0
+    assert legacy.execute("""SELECT COUNT(*) FROM stocks""").fetchone()[0] == 4
+
+    legacy.execute("""DROP VIEW stocks_date_idx""")
+    legacy.commit()
+
+    assert db.migrate_db(legacy) == 3
+
+
+def test_leftover_table_is_dropped(legacy):
+    legacy.execute("""CREATE TABLE stocks_v2 (symbol VARCHAR)""")
+    legacy.commit()
+
+    assert db.migrate_db(legacy) == 3
+
+
+def test_uninitialised_database(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'empty.sqlite'))
+
+    with pytest.raises(sqlite3.OperationalError, match='init-db'):
+        db.migrate_db(conn)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from pca_dax.data_handler import PCA
+
+
+def make_returns(n_days: int, n_stocks: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame(
+        rng.normal(0, 0.01, (n_days, n_stocks))
+        , index=pd.bdate_range('2020-01-01', periods=n_days)
+        , columns=[f'S{i}' for i in range(n_stocks)]
+    )
+
+
+def test_transform_with_another_models_result():
+    PCA.clear_cache()
+    data_a = make_returns(100, 8, seed=0)
+    data_b = make_returns(50, 8, seed=1)
+    pca_a, pca_b = PCA(data=data_a), PCA(data=data_b)
+    result_a = pca_a.fit(n_comp=3)
+
+    scores_a = pca_a.transform(result=result_a)
+    scores_b = pca_b.transform(result=result_a)
+
+    assert scores_a.shape == (100, 3)
+    assert scores_b.shape == (50, 3)
+    np.testing.assert_allclose(scores_b.to_numpy(), data_b.to_numpy() @ result_a.loadings.to_numpy())
+
+
+def test_randomized_seeds_are_cached_apart():
+    PCA.clear_cache()
+    data = make_returns(100, 8, seed=0)
+    first = PCA(data=data, solver='randomized', random_state=0).fit(n_comp=3)
+    second = PCA(data=data, solver='randomized', random_state=1).fit(n_comp=3)
+
+    assert first.key != second.key
+    assert PCA(data=data, solver='randomized', tol=1e-3).fit(n_comp=3).key != first.key
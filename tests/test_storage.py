@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+from pca_dax import db
+from pca_dax import storage as st
+from pca_dax.data_handler import DataHandler
+from tests.conftest import SYMBOLS
+
+
+def read_returns(storage) -> pd.DataFrame:
+    return DataHandler(tickers=set(SYMBOLS), start_date='2023-01-01', end_date='2023-12-31'
+                       , storage=storage).create_daily_change()
+
+
+def test_missing_snapshot_reads_sqlite(stocks, tmp_path):
+    snapshot = st.ParquetStorage(directory=str(tmp_path / 'snapshot'))
+
+    assert snapshot.get_version() == ('sqlite', db.get_data_version())
+    assert sorted(snapshot.read_info(SYMBOLS)['symbol']) == SYMBOLS
+    pd.testing.assert_frame_equal(read_returns(snapshot), read_returns(st.SQLiteStorage()))
+
+
+def test_read_after_clear(stocks, tmp_path):
+    pytest.importorskip('pyarrow')
+    snapshot = st.ParquetStorage(directory=str(tmp_path / 'snapshot'))
+    snapshot.refresh()
+    handler = DataHandler(tickers=set(SYMBOLS), start_date='2023-01-01', end_date='2023-12-31', storage=snapshot)
+
+    before = handler.create_daily_change()
+    version = snapshot.get_version()
+    snapshot.clear()
+
+    assert snapshot.get_version() != version
+    after = handler.create_daily_change()
+
+    assert after is not before
+    pd.testing.assert_frame_equal(after, before, check_freq=False)